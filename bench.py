@@ -0,0 +1,197 @@
+## Benchmarks for the hot paths of the challenge solutions
+##
+## python bench.py                         - run and print throughput
+## python bench.py --save base.json        - also record the results as a baseline
+## python bench.py --compare base.json     - fail (exit 1) on a regression past --threshold
+
+import argparse
+import json
+import os
+import sys
+import time
+from base64 import b64decode
+from p02 import byte_xor
+from p03 import single_byte_xor_break, single_char_xor
+from p04 import detect_single_byte_xor
+from p05 import rep_key_xor
+from p06 import hamming, guess_key_length, break_repeating_key_xor
+from p07 import aes_ecb_decrypt
+from p08 import aes_ecb_repeats
+from p09 import pkcs7pad
+from p10 import cbc_encrypt, cbc_decrypt, aes_batch
+from oracle_stats import instrument_oracle
+from p12 import make_ecb_encrypt_oracle, ecb_decrypt_oracle, profile_cache, probe_table_cache
+
+KB = 1 << 10
+MB = 1 << 20
+
+def english_text(size):
+    '''
+    Returns size bytes of English text, the decrypted S1C07 lyrics repeated
+    '''
+
+    with open("p07_in.txt") as input_file:
+        text = aes_ecb_decrypt(b64decode(input_file.read()), b"YELLOW SUBMARINE").rstrip(b"\x04")
+    return (text * (size // len(text) + 1))[:size]
+
+def oracle_calls_per_byte(size):
+    '''
+    Runs ecb_decrypt_oracle against a fresh oracle with a size byte secret, with all caches
+    cleared, and returns the number of oracle calls per recovered byte
+    '''
+
+    secret = os.urandom(size)
+    enc_oracle = make_ecb_encrypt_oracle(os.urandom(16), secret)
+    counted_oracle = instrument_oracle(enc_oracle)
+
+    profile_cache.clear()
+    probe_table_cache.clear()
+    assert ecb_decrypt_oracle(counted_oracle) == secret, "ecb_decrypt_oracle recovered a wrong secret"
+    return counted_oracle.stats['calls'] / size
+
+batch_keys = [os.urandom(16) for i in range(16)] # aes_batch records are spread over 16 keys
+
+# name -> (sizes, setup(size) -> args, func(*args)), throughput in MB/s of size bytes per call
+throughput_cases = {
+    'byte_xor': ([KB, 64*KB, MB], lambda n: (os.urandom(n), os.urandom(n)), byte_xor),
+    'rep_key_xor': ([KB, 64*KB, MB], lambda n: (os.urandom(n), b"ICE"), rep_key_xor),
+    'single_byte_xor_break': ([64, KB, 64*KB],
+                              lambda n: (single_char_xor(english_text(n), 88),), single_byte_xor_break),
+    'detect_single_byte_xor': ([KB, 16*KB],
+                               lambda n: ([os.urandom(60) for i in range(n // 60)],), detect_single_byte_xor),
+    'hamming': ([KB, 64*KB, MB], lambda n: (os.urandom(n), os.urandom(n)), hamming),
+    'guess_key_length': ([4*KB, 64*KB, MB],
+                         lambda n: (rep_key_xor(english_text(n), b"Terminator"), 2, 40, 'hamming'), guess_key_length),
+    'break_repeating_key_xor': ([4*KB, 64*KB],
+                                lambda n: (rep_key_xor(english_text(n), b"Terminator"), 2, 40, 'hamming', 1),
+                                break_repeating_key_xor),
+    'cbc_encrypt': ([KB, 64*KB, MB], lambda n: (os.urandom(n), os.urandom(16)), cbc_encrypt),
+    'cbc_decrypt': ([KB, 64*KB, MB], lambda n: (os.urandom(n), os.urandom(16)), cbc_decrypt),
+    'aes_batch': ([64*KB, MB], lambda n: ([(batch_keys[i % 16], os.urandom(16), os.urandom(64)) for i in range(n // 64)],
+                                          "CBC", True), aes_batch),
+    'aes_ecb_repeats': ([KB, 64*KB, MB], lambda n: (os.urandom(n),), aes_ecb_repeats),
+    'pkcs7pad': ([16, KB, 64*KB], lambda n: (os.urandom(n - 1), 16), pkcs7pad),
+}
+
+# name -> (sizes, func(size) -> metric), metric where lower is better
+count_cases = {
+    'ecb_decrypt_oracle': ([64, 256], oracle_calls_per_byte),
+}
+
+def time_call(func, args, min_time=0.2):
+    '''
+    Calls func(*args) repeatedly for at least min_time seconds and returns the fastest call time
+
+    Inputs
+
+        func - func pointer - Function being timed
+        args - tuple - Its arguments
+        min_time - float - Seconds to keep repeating for - default=0.2
+
+    Outputs
+
+        best - float - Fastest call, in seconds
+    '''
+
+    best = float('inf')
+    deadline = time.perf_counter() + min_time
+    while True:
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            return best
+
+def run_benchmarks(only=None, min_time=0.2):
+    '''
+    Runs every benchmark case at each of its input sizes
+
+    Inputs
+
+        only - list(string) - Names of the cases to run, None for all - default=None
+        min_time - float - Seconds each case and size is repeated for - default=0.2
+
+    Outputs
+
+        results - dict - {name: {'unit': unit, 'sizes': {size: metric}}}
+    '''
+
+    results = {}
+    for name, (sizes, setup, func) in throughput_cases.items():
+        if only and name not in only:
+            continue
+        results[name] = {'unit': 'MB/s', 'sizes': {}}
+        for size in sizes:
+            best = time_call(func, setup(size), min_time)
+            results[name]['sizes'][str(size)] = size / best / MB
+            print("{:<26}{:>10} B {:>12.2f} MB/s".format(name, size, results[name]['sizes'][str(size)]))
+
+    for name, (sizes, func) in count_cases.items():
+        if only and name not in only:
+            continue
+        results[name] = {'unit': 'calls/byte', 'sizes': {}}
+        for size in sizes:
+            results[name]['sizes'][str(size)] = func(size)
+            print("{:<26}{:>10} B {:>12.2f} calls/byte".format(name, size, results[name]['sizes'][str(size)]))
+
+    return results
+
+def find_regressions(results, baseline, threshold=0.2):
+    '''
+    Compares results with a baseline. MB/s may not drop, and calls/byte may not rise, by more than threshold.
+
+    Inputs
+
+        results - dict - Output of run_benchmarks
+        baseline - dict - Earlier output of run_benchmarks
+        threshold - float - Allowed relative change - default=0.2
+
+    Outputs
+
+        regressions - list(string) - One line per regressed case and size
+    '''
+
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or base['unit'] != result['unit']:
+            continue
+        for size, metric in result['sizes'].items():
+            base_metric = base['sizes'].get(size)
+            if base_metric is None:
+                continue
+            if result['unit'] == 'MB/s':
+                regressed = metric < base_metric * (1 - threshold)
+            else:
+                regressed = metric > base_metric * (1 + threshold)
+            if regressed:
+                regressions.append("{} at {} B: {:.2f} {} vs baseline {:.2f}".format(
+                    name, size, metric, result['unit'], base_metric))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the challenge primitives")
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to check the results against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case and size")
+    parser.add_argument("--only", nargs="*", help="names of the cases to run")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.min_time)
+
+    if args.save:
+        with open(args.save, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as input_file:
+            regressions = find_regressions(results, json.load(input_file), args.threshold)
+        for line in regressions:
+            print("REGRESSION:", line)
+        if regressions:
+            sys.exit(1)
+        print("No regressions past {:.0%}".format(args.threshold))
+
+if __name__ == "__main__":
+    main()
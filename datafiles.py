@@ -0,0 +1,271 @@
+## Memory-mapped loading of the challenge data files
+##
+## Files are memory-mapped rather than read, and decoded lazily, one hex line or one chunk
+## of base64 at a time, yielding memoryviews. The decoded binary form can be cached next to
+## the source file (<path>.<encoding>.bin), so later runs map the cache and skip decoding.
+## The chunked reader and base64 codecs are also used by the AES streaming of p10.
+##
+## Cache layout - header (magic, source size, source mtime in ns), the decoded records back
+## to back, their offsets as native array('Q') (records + 1 entries), then the record count.
+
+import mmap
+import os
+import struct
+from array import array
+from base64 import b64decode, b64encode
+from binascii import unhexlify
+from contextlib import contextmanager
+from io import BytesIO
+
+cache_magic = b"CPDATA01"
+cache_header = struct.Struct(">8sQQ")
+cache_count = struct.Struct(">Q")
+
+@contextmanager
+def mapped(path):
+    '''
+    Memory-maps a file read-only for the duration of a with block
+
+    Inputs
+
+        path - string - File path
+
+    Outputs
+
+        mm - mmap - Read-only map of the whole file, readable as a file object (read, seek)
+                    or through memoryview(mm). An empty file gives an empty mmap-like buffer.
+    '''
+
+    with open(path, "rb") as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0: # mmap cannot map an empty file
+            yield BytesIO(b'')
+            return
+        mm = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            try:
+                mm.close()
+            except BufferError: # views are still held, the map closes once they are released
+                pass
+
+def buffer_view(buf):
+    '''
+    Returns a memoryview of a bytes-like object, mmap or BytesIO
+    '''
+
+    return memoryview(buf.getbuffer() if isinstance(buf, BytesIO) else buf)
+
+def iter_lines(buf):
+    '''
+    Yields each non-empty line of buf as a memoryview, without its line ending
+
+    Inputs
+
+        buf - bytes/bytearray/mmap - Buffer, e.g. from mapped
+
+    Outputs
+
+        line - memoryview - Next line
+    '''
+
+    mv = buffer_view(buf)
+    if not mv:
+        return
+    find = buf.find
+    pos = 0
+    while pos < len(mv):
+        end = find(b"\n", pos)
+        if end < 0:
+            end = len(mv)
+        line = mv[pos:end]
+        if line and line[-1] == 13: # "\r\n" endings
+            line = line[:-1]
+        if line:
+            yield line
+        pos = end + 1
+
+def hex_line_records(buf):
+    '''
+    Yields each hex encoded line of buf decoded to binary, one line at a time
+    '''
+
+    for line in iter_lines(buf):
+        yield memoryview(unhexlify(line))
+
+def read_chunks(src, chunk_size=1 << 16):
+    '''
+    Yields successive chunks read from a file object or mmap until it is exhausted
+
+    Inputs
+
+        src - file object/mmap - Anything with a read(size) method
+        chunk_size - int - Maximum chunk length - default=65536
+
+    Outputs
+
+        chunk - string/bytestring - Next chunk of src
+    '''
+
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def b64_decode_chunks(chunks):
+    '''
+    Base64-decodes a stream of text or byte chunks incrementally, ignoring whitespace such as
+    line breaks. Characters that do not complete a 4 character group are carried to the next chunk.
+
+    Inputs
+
+        chunks - iterable(string/bytestring) - Base64 encoded chunks
+
+    Outputs
+
+        data - bytestring - Next decoded chunk
+    '''
+
+    rest = b''
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        data = rest + b''.join(chunk.split())
+        cut = len(data) - len(data) % 4
+        rest = data[cut:]
+        if cut:
+            yield b64decode(data[:cut])
+    if rest:
+        yield b64decode(rest)
+
+def b64_encode_chunks(chunks):
+    '''
+    Base64-encodes a stream of byte chunks incrementally. Bytes that do not complete a 3 byte
+    group are carried to the next chunk, so the output concatenates to one valid encoding.
+
+    Inputs
+
+        chunks - iterable(bytestring) - Raw chunks
+
+    Outputs
+
+        data - bytestring - Next encoded chunk
+    '''
+
+    rest = b''
+    for chunk in chunks:
+        data = rest + chunk
+        cut = len(data) - len(data) % 3
+        rest = data[cut:]
+        if cut:
+            yield b64encode(data[:cut])
+    if rest:
+        yield b64encode(rest)
+
+def b64_records(buf, chunk_size=1 << 16):
+    '''
+    Yields base64 encoded buf (line breaks allowed) decoded to binary, one chunk at a time
+    '''
+
+    mv = buffer_view(buf)
+    chunks = (bytes(mv[i:i + chunk_size]) for i in range(0, len(mv), chunk_size))
+    for data in b64_decode_chunks(chunks):
+        yield memoryview(data)
+
+decoders = {'hex_lines': hex_line_records, 'base64': b64_records}
+
+def cache_path(path, encoding):
+    '''
+    Returns the path of the decoded binary cache of path
+    '''
+
+    return "{}.{}.bin".format(path, encoding)
+
+def cache_valid(path, encoding):
+    '''
+    Returns True if the cache of path exists and was written from its current version
+    '''
+
+    try:
+        with open(cache_path(path, encoding), "rb") as cache_file:
+            magic, size, mtime = cache_header.unpack(cache_file.read(cache_header.size))
+    except (OSError, struct.error):
+        return False
+    stat = os.stat(path)
+    return magic == cache_magic and size == stat.st_size and mtime == stat.st_mtime_ns
+
+def cached_records(path, encoding):
+    '''
+    Yields the records of a valid cache as memoryviews of its memory map
+    '''
+
+    with mapped(cache_path(path, encoding)) as mm:
+        mv = memoryview(mm)
+        count, = cache_count.unpack(mv[-cache_count.size:])
+        offsets = array('Q')
+        offsets.frombytes(mv[-cache_count.size - 8 * (count + 1):-cache_count.size])
+        for i in range(count):
+            yield mv[offsets[i]:offsets[i + 1]]
+
+def write_cache(path, encoding, records):
+    '''
+    Passes records through while writing them to the cache of path. The cache only replaces
+    an older one once every record has been written. If the caller stops early or decoding
+    fails, the partial temporary file is removed.
+    '''
+
+    stat = os.stat(path)
+    tmp_path = cache_path(path, encoding) + ".tmp"
+    offsets = array('Q', [cache_header.size])
+    done = False
+    try:
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(cache_header.pack(cache_magic, stat.st_size, stat.st_mtime_ns))
+            for record in records:
+                cache_file.write(record)
+                offsets.append(offsets[-1] + len(record))
+                yield record
+            cache_file.write(offsets.tobytes())
+            cache_file.write(cache_count.pack(len(offsets) - 1))
+        os.replace(tmp_path, cache_path(path, encoding))
+        done = True
+    finally:
+        if not done:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def load_records(path, encoding, cache=False):
+    '''
+    Yields the decoded contents of a data file lazily, as memoryviews
+
+    Inputs
+
+        path - string - Data file path
+        encoding - string - 'hex_lines' (one record per line) or 'base64' (records are chunks)
+        cache - bool - Read the decoded cache if it is valid, else write it - default=False
+
+    Outputs
+
+        record - memoryview - Next decoded record, a view of the cache's memory map when cached
+    '''
+
+    if encoding not in decoders:
+        raise ValueError("Unknown encoding: {}".format(encoding))
+
+    if cache and cache_valid(path, encoding):
+        yield from cached_records(path, encoding)
+        return
+
+    with mapped(path) as mm:
+        records = decoders[encoding](mm)
+        yield from write_cache(path, encoding, records) if cache else records
+
+def load_bytes(path, encoding, cache=False):
+    '''
+    Returns the whole decoded contents of a data file, see load_records
+    '''
+
+    return b''.join(load_records(path, encoding, cache))
@@ -0,0 +1,168 @@
+## Asyncio oracle client and local oracle server
+##
+## Serves any oracle function pointer (e.g. p11.ecb_cbc_encrypt_oracle, p12.ecb_encrypt_oracle)
+## over TCP or a Unix socket, so attacks can be run against an oracle with real latency.
+## Every request and response is a 4-byte big-endian length followed by that many bytes.
+## Responses on a connection come back in request order, so clients may pipeline.
+
+import asyncio
+import struct
+import time
+from collections import deque
+from p11 import ecb_cbc_encrypt_oracle, async_ecb_cbc_detect_oracle
+from p12 import ecb_encrypt_oracle, async_ecb_decrypt_oracle
+
+frame_header = struct.Struct('>I')
+
+async def read_frame(reader):
+    '''
+    Reads one length-prefixed frame
+
+    Inputs
+
+        reader - asyncio.StreamReader - Connection to read from
+
+    Outputs
+
+        data - bytestring - Frame payload
+    '''
+
+    header = await reader.readexactly(frame_header.size)
+    return await reader.readexactly(frame_header.unpack(header)[0])
+
+def write_frame(writer, data):
+    '''
+    Queues one length-prefixed frame on writer, without waiting for it to be sent
+
+    Inputs
+
+        writer - asyncio.StreamWriter - Connection to write to
+        data - bytestring - Frame payload
+    '''
+
+    writer.write(frame_header.pack(len(data)))
+    writer.write(data)
+
+async def start_oracle_server(enc_oracle, host='127.0.0.1', port=0, path=None):
+    '''
+    Starts a server that answers every request msg with enc_oracle(msg)
+
+    Inputs
+
+        enc_oracle - func pointer - Oracle to serve
+        host - string - Address to listen on - default='127.0.0.1'
+        port - int - Port to listen on, 0 picks a free one - default=0
+        path - string - Listen on this Unix socket instead of TCP - default=None
+
+    Outputs
+
+        server - asyncio.Server - Running server, bound address in server.sockets[0].getsockname()
+    '''
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                msg = await read_frame(reader)
+                write_frame(writer, enc_oracle(msg))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError): # client went away
+            pass
+        finally:
+            writer.close()
+
+    if path is not None:
+        return await asyncio.start_unix_server(handle, path=path)
+    return await asyncio.start_server(handle, host, port)
+
+async def connect_oracle(host='127.0.0.1', port=None, path=None, max_in_flight=64):
+    '''
+    Connects to an oracle server and returns an asyncio oracle: await oracle(msg) gives the
+    ciphertext for msg. Queries from concurrent tasks are pipelined on the one connection,
+    with at most max_in_flight of them sent and not yet answered.
+    await oracle.batch(msgs) queries a list concurrently, await oracle.close() disconnects.
+
+    Inputs
+
+        host - string - Server address - default='127.0.0.1'
+        port - int - Server port - default=None
+        path - string - Connect to this Unix socket instead of TCP - default=None
+        max_in_flight - int - Limit on pipelined queries - default=64
+
+    Outputs
+
+        oracle(bytestring msg) - async func pointer - Encryption oracle
+    '''
+
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    answers = deque() # futures of sent queries, in send order
+    slots = asyncio.Semaphore(max_in_flight)
+
+    async def read_answers():
+        try:
+            while True:
+                ciph = await read_frame(reader)
+                fut = answers.popleft()
+                if not fut.done(): # the querying task may have been cancelled
+                    fut.set_result(ciph)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            while answers:
+                fut = answers.popleft()
+                if not fut.done():
+                    fut.set_exception(ConnectionError("Oracle connection closed"))
+
+    reader_task = asyncio.ensure_future(read_answers())
+
+    async def oracle(msg):
+        async with slots:
+            fut = asyncio.get_running_loop().create_future()
+            answers.append(fut)
+            write_frame(writer, msg)
+            await writer.drain()
+            return await fut
+
+    async def oracle_batch(msgs):
+        return await asyncio.gather(*[oracle(msg) for msg in msgs])
+
+    async def close():
+        writer.close()
+        await writer.wait_closed()
+        reader_task.cancel()
+
+    oracle.batch = oracle_batch
+    oracle.close = close
+    return oracle
+
+async def run_attacks(max_in_flight=64):
+    '''
+    Serves the p11 and p12 oracles on local TCP ports and runs their attacks through clients
+    '''
+
+    for name, enc_oracle in (("p11", ecb_cbc_encrypt_oracle), ("p12", ecb_encrypt_oracle)):
+        server = await start_oracle_server(enc_oracle)
+        port = server.sockets[0].getsockname()[1]
+        oracle = await connect_oracle(port=port, max_in_flight=max_in_flight)
+
+        start_time = time.perf_counter()
+        if name == "p11":
+            result = await asyncio.gather(*[async_ecb_cbc_detect_oracle(oracle) for i in range(10)])
+        else:
+            result = (await async_ecb_decrypt_oracle(oracle)).decode("utf-8")
+        elapsed = time.perf_counter() - start_time
+
+        print("---{} over TCP port {} ({:.3f}s)---\n".format(name, port, elapsed))
+        print(result)
+        print()
+
+        await oracle.close()
+        server.close()
+        await server.wait_closed()
+
+def main():
+    asyncio.run(run_attacks())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+## Oracle call-count and latency instrumentation
+##
+## instrument_oracle wraps any oracle function pointer and counts its calls, bytes sent and
+## received, and a latency histogram. Attacks report which phase they are in through
+## mark_phase. Inside a profile_phases block, wall time and oracle calls are also broken
+## down per phase. Outside one, mark_phase only does one global lookup.
+
+import time
+from contextlib import contextmanager
+
+phase_hook = None # set by profile_phases, called by mark_phase with each new phase name
+
+def mark_phase(name):
+    '''
+    Tells the active profiling hook, if any, that the attack is entering phase name
+
+    Inputs
+
+        name - string - Phase, e.g. 'block_size', 'mode_detection', 'dictionary', 'matching'
+    '''
+
+    if phase_hook is not None:
+        phase_hook(name)
+
+def new_stats():
+    '''
+    Returns an empty statistics record, shared by instrument_oracle and profile_phases
+
+    Outputs
+
+        stats - dict - calls, batches, bytes_sent, bytes_received, latency_hist
+                       ({upper bound in us: calls}), phases ({name: {'time', 'calls'}})
+                       and the current phase
+    '''
+
+    return {'calls': 0, 'batches': 0, 'bytes_sent': 0, 'bytes_received': 0,
+            'latency_hist': {}, 'phases': {}, 'phase': None}
+
+def record_call(stats, sent, received, latency):
+    '''
+    Adds one oracle call to stats. Latencies go into power of two buckets of microseconds.
+
+    Inputs
+
+        stats - dict - Statistics record from new_stats
+        sent - int - Bytes sent to the oracle
+        received - int - Bytes received from the oracle
+        latency - float - Seconds the call took
+    '''
+
+    stats['calls'] += 1
+    stats['bytes_sent'] += sent
+    stats['bytes_received'] += received
+    bucket = 1 << int(latency * 1e6).bit_length()
+    stats['latency_hist'][bucket] = stats['latency_hist'].get(bucket, 0) + 1
+    if stats['phase'] is not None:
+        stats['phases'][stats['phase']]['calls'] += 1
+
+def instrument_oracle(enc_oracle, stats=None):
+    '''
+    Wraps an oracle so every call is recorded in stats. A batch form (enc_oracle.batch) is
+    wrapped too, counting one batch and one call per message.
+
+    Inputs
+
+        enc_oracle - func pointer - Oracle to instrument
+        stats - dict - Statistics record to add to, a new one if None - default=None
+
+    Outputs
+
+        oracle - func pointer - Instrumented oracle, with its record as oracle.stats and
+                                enc_oracle as oracle.__wrapped__
+    '''
+
+    if stats is None:
+        stats = new_stats()
+
+    def oracle(msg):
+        start = time.perf_counter()
+        ciph = enc_oracle(msg)
+        record_call(stats, len(msg), len(ciph), time.perf_counter() - start)
+        return ciph
+
+    batch = getattr(enc_oracle, 'batch', None)
+    if batch is not None:
+        def oracle_batch(msgs):
+            start = time.perf_counter()
+            ciphs = batch(msgs)
+            latency = (time.perf_counter() - start) / max(len(msgs), 1)
+            stats['batches'] += 1
+            for msg, ciph in zip(msgs, ciphs):
+                record_call(stats, len(msg), len(ciph), latency)
+            return ciphs
+        oracle.batch = oracle_batch
+
+    oracle.stats = stats
+    oracle.__wrapped__ = enc_oracle # caches keyed by oracle treat the wrapper as enc_oracle
+    return oracle
+
+def instrument_async_oracle(enc_oracle, stats=None):
+    '''
+    Same as instrument_oracle, for an asyncio oracle (see oracle_net.connect_oracle).
+    Latency is measured per awaited call, so it includes time queued behind other queries.
+    '''
+
+    if stats is None:
+        stats = new_stats()
+
+    async def oracle(msg):
+        start = time.perf_counter()
+        ciph = await enc_oracle(msg)
+        record_call(stats, len(msg), len(ciph), time.perf_counter() - start)
+        return ciph
+
+    oracle.stats = stats
+    oracle.__wrapped__ = enc_oracle
+    return oracle
+
+@contextmanager
+def profile_phases(stats=None):
+    '''
+    Installs a phase hook for the duration of a with block. Wall time between mark_phase calls
+    goes to the phase that was entered, and calls through an instrumented oracle sharing
+    stats are counted against the current phase.
+
+    Inputs
+
+        stats - dict - Statistics record to add to, a new one if None - default=None
+
+    Outputs
+
+        stats - dict - The statistics record, as the target of the with statement
+    '''
+
+    global phase_hook
+
+    if stats is None:
+        stats = new_stats()
+    entered = [time.perf_counter()]
+
+    def hook(name):
+        now = time.perf_counter()
+        if stats['phase'] is not None:
+            stats['phases'][stats['phase']]['time'] += now - entered[0]
+        if name is not None and name not in stats['phases']:
+            stats['phases'][name] = {'time': 0.0, 'calls': 0}
+        stats['phase'] = name
+        entered[0] = now
+
+    phase_hook = hook
+    try:
+        yield stats
+    finally:
+        hook(None)
+        phase_hook = None
+
+def format_stats(stats):
+    '''
+    Returns a readable summary of a statistics record
+    '''
+
+    lines = ["Oracle calls: {} ({} batches), bytes sent: {}, bytes received: {}".format(
+        stats['calls'], stats['batches'], stats['bytes_sent'], stats['bytes_received'])]
+    lines.append("Latency histogram:")
+    for bucket in sorted(stats['latency_hist']):
+        lines.append("  < {:>8} us: {}".format(bucket, stats['latency_hist'][bucket]))
+    if stats['phases']:
+        lines.append("Phases:")
+        for name, phase in stats['phases'].items():
+            lines.append("  {:<16} {:>9.4f} s {:>8} calls".format(name, phase['time'], phase['calls']))
+    return "\n".join(lines)
+
+def main():
+    # run as a script this module is __main__, the attacks mark phases on the imported copy
+    from oracle_stats import instrument_oracle, profile_phases
+    from p12 import ecb_encrypt_oracle, ecb_decrypt_oracle
+
+    oracle = instrument_oracle(ecb_encrypt_oracle)
+    with profile_phases(oracle.stats):
+        b_suf = ecb_decrypt_oracle(oracle)
+
+    print(b_suf.decode("utf-8"))
+    print(format_stats(oracle.stats))
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,59 @@
 
 import base64
 
+XOR_CHUNK = 1 << 20  # max keystream bytes held in memory when cycling a key
+
+def xor_into(out, ba1, ba2):
+    '''
+    Writes the bitwise XOR of two buffers into out. The XOR is done as one big-integer
+    operation instead of byte by byte. out may be ba1 or ba2 itself for in-place use.
+
+    Inputs
+
+        out - bytearray/memoryview - Writable output buffer, at least as long as the shorter input
+        ba1 - bytestring - First buffer
+        ba2 - bytestring - Second buffer
+
+    Outputs
+
+        n - int - Number of bytes written, i.e. length of the shorter input
+    '''
+    n = min(len(ba1), len(ba2))
+    a = int.from_bytes(memoryview(ba1)[:n], 'little')
+    b = int.from_bytes(memoryview(ba2)[:n], 'little')
+    memoryview(out)[:n] = (a ^ b).to_bytes(n, 'little')
+    return n
+
+def cyclic_xor_into(out, msg, key, phase=0):
+    '''
+    Writes msg XOR-ed with copies of key placed end to end into out. Only a keystream
+    block of about XOR_CHUNK bytes is ever built, and it is reused for every chunk of msg.
+
+    Inputs
+
+        out - bytearray/memoryview - Writable output buffer of length len(msg), may be msg itself
+        msg - bytestring - Message
+        key - bytestring - Repeating key
+        phase - int - Index into key that lines up with msg[0] - default=0
+
+    Outputs
+
+        phase - int - Index into key that lines up with the byte after msg, for continuing a stream
+    '''
+    klen = len(key)
+    n = len(msg)
+    phase %= klen
+    reps = min(max(1, XOR_CHUNK // klen), n // klen + 1)
+    keystream = (key[phase:] + key[:phase]) * reps
+    step = len(keystream)
+
+    b_msg = memoryview(msg)
+    b_out = memoryview(out)
+    for start in range(0, n, step):
+        xor_into(b_out[start:start + step], b_msg[start:start + step], keystream)
+
+    return (phase + n) % klen
+
 def byte_xor(ba1, ba2):
     '''
     Returns the bitwise XOR of two equal length buffers
@@ -11,7 +64,9 @@ def byte_xor(ba1, ba2):
         ba1 - bytestring - First bytestring
         ba2 - bytestring - Second bytestring
     '''
-    return bytes([_a ^ _b for _a, _b in zip(ba1, ba2)])
+    out = bytearray(min(len(ba1), len(ba2)))
+    xor_into(out, ba1, ba2)
+    return bytes(out)
 
 def main():
     hex_msg = "1c0111001f010100061a024b53535009181c"
@@ -1,15 +1,26 @@
 ## S1C03 - Breaking Single Byte XOR Cipher
 
-# From https://en.wikipedia.org/wiki/Letter_frequency
-character_frequencies = {
-    'a': .08167, 'b': .01492, 'c': .02782, 'd': .04253,
-    'e': .12702, 'f': .02228, 'g': .02015, 'h': .06094,
-    'i': .06094, 'j': .00153, 'k': .00772, 'l': .04025,
-    'm': .02406, 'n': .06749, 'o': .07507, 'p': .01929,
-    'q': .00095, 'r': .05987, 's': .06327, 't': .09056,
-    'u': .02758, 'v': .00978, 'w': .02360, 'x': .00150,
-    'y': .01974, 'z': .00074, ' ': .13000
-}
+import string
+from collections import Counter
+from scoring import default_model, score_all_keys, score_buffer
+
+# Frequencies have 5 decimal places, so scaling by 10^5 gives exact integer scores
+# that can be summed in any order without changing which key wins
+score_scale = 100000
+
+# byte_scores[b] - scaled score of plaintext byte b, from the unigram table of default_model
+byte_scores = [round(score * score_scale) for score in default_model['unigram']]
+
+# xor_tables[k] - bytes.translate table mapping each byte b to b ^ k
+xor_tables = [bytes([b ^ k for b in range(256)]) for k in range(256)]
+
+# key_score_table[k][c] - scaled score of ciphertext byte c decrypted under key k
+key_score_table = [[byte_scores[c ^ k] for c in range(256)] for k in range(256)]
+
+# Plaintext bytes a candidate key may produce, and rejected_masks[k] - bitmask of the
+# ciphertext bytes c for which c ^ k is not allowed
+allowed_bytes = frozenset(string.printable.encode())
+rejected_masks = [sum([1 << c for c in range(256) if c ^ k not in allowed_bytes]) for k in range(256)]
 
 def single_char_xor(msg, key):
     '''
@@ -25,48 +36,113 @@ def single_char_xor(msg, key):
         res - bytestring - Single byte XOR-ed result
     '''
 
-    res = b''
-    for byte in msg:
-        res += bytes([byte ^ key])
+    res = bytes(msg).translate(xor_tables[key])
     return res
 
-def get_english_score(input_bytes):
+def get_english_score(input_bytes, model=default_model):
     '''
     Compares each input byte to a character frequency chart and returns the score of a message based on the
     relative frequency the characters occur in the English language.
+    Other scoring models (bigrams, chi-squared, log-likelihood) are in scoring.py.
     
     Inputs
 
         input_bytes - bytestring - Bytestring to be scored
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model
 
     Outputs
 
         score - float - Weighted score using letter freqeuncy chart
     '''
     
-    return sum([character_frequencies.get(chr(byte), 0) for byte in input_bytes.lower()])
+    return score_buffer(model, input_bytes)
+
+def printable_keys(ciph):
+    '''
+    Returns the keys that decrypt every byte of ciph to a printable byte, by testing the
+    bitmask of the byte values present in ciph against rejected_masks
+
+    Inputs
+
+        ciph - bytestring - Ciphertext
+
+    Outputs
 
-def single_byte_xor_break(ciph):
+        keys - list(int) - Surviving keys, in increasing order
     '''
-    Returns plaintext from ciphertext encrypted by single byte XOR cipher, using letter frequency analysis
+
+    present = 0
+    for byte in set(ciph):
+        present |= 1 << byte
+    return [k for k in range(256) if not present & rejected_masks[k]]
+
+def best_count_keys(counts, keys=range(256)):
+    '''
+    Scores keys from a byte histogram using key_score_table and returns those with the best
+    score. The scores are exact integers, so every key on an exact tie is returned.
+
+    Inputs
+
+        counts - iterable((int, int)) - (byte value, occurrences) for each distinct ciphertext byte
+        keys - iterable(int) - Keys to score - default=range(256)
+
+    Outputs
+
+        best_keys - list(int) - Keys with the best score, in the order of keys
+    '''
+
+    counts = list(counts)
+    best_keys = []
+    best_total = -1
+    for i in keys:
+        row = key_score_table[i]
+        total = sum([row[byte] * n for byte, n in counts])
+        if total > best_total:
+            best_keys = [i]
+            best_total = total
+        elif total == best_total:
+            best_keys.append(i)
+
+    return best_keys
+
+def single_byte_xor_break(ciph, prune=True, keys=None, model=default_model):
+    '''
+    Returns plaintext from ciphertext encrypted by single byte XOR cipher, using letter frequency analysis.
+    Keys are scored from one byte histogram of the ciphertext using key_score_table, and only
+    the winning key (or keys, on an exact tie) is used to decrypt. Any other model scores
+    the keys with scoring.score_all_keys instead.
+    With prune, keys giving non-printable bytes are dropped first (see printable_keys) and
+    only the survivors are scored. If none survive, all 256 keys are scored.
 
     Inputs
 
         ciph - bytestring - Ciphertext
+        prune - bool - Only score keys that give printable plaintext - default=True
+        keys - list(int) - Keys to score, overriding prune - default=None
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model
 
     Outputs
 
-        best_score - list(msg, score, key) - List containing the plaintext, its score and key
+        best_score - dict(message, score, key) - Dictionary containing the plaintext, its score and key
     '''    
 
-    potent = []
-    for i in range(256): # Iterate over all possible ASCII characters for the key
+    if keys is None:
+        keys = (prune and printable_keys(ciph)) or range(256)
+    if model is default_model:
+        best_keys = best_count_keys(Counter(ciph).items(), keys)
+    else:
+        scores = score_all_keys(model, ciph)
+        best_total = max([scores[i] for i in keys])
+        best_keys = [i for i in keys if scores[i] == best_total]
+
+    # Keys tied on the exact score (e.g. k and k^0x20 on all-letter text) are settled by the
+    # float score in message order, so the same key wins as when every key was decrypted
+    best_score = None
+    for i in best_keys:
         b_xor_msg = single_char_xor(ciph, i)
-        score = get_english_score(b_xor_msg)
-        data = [b_xor_msg, score, i]
-        potent.append(data)
-
-    best_score = sorted(potent, key=lambda x: x[1], reverse=True)[0] # Get the message with the highest score
+        score = get_english_score(b_xor_msg, model)
+        if best_score is None or score > best_score['score']:
+            best_score = {'message': b_xor_msg, 'score': score, 'key': i}
 
     return best_score
     
@@ -1,54 +1,204 @@
 ## S1C04 - Detecting a single byte XOR cipher among random character snippets
 
-from p03 import single_char_xor, get_english_score, character_frequencies
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from itertools import islice
+from p03 import single_byte_xor_break, printable_keys
+from scoring import default_model
+from datafiles import mapped, iter_lines
 
-def detect_single_byte_xor(ciph_lst):
+def push_top(top, top_k, cand):
+    '''
+    Pushes a candidate onto a running top-K min-heap, evicting the weakest entry once full
+
+    Inputs
+
+        top - list - Min-heap of candidate tuples, e.g. (printable, score, -entry, key, msg)
+        top_k - int - Maximum number of candidates kept
+        cand - tuple - Candidate, compared as a tuple, with -entry right after the ranking fields
+    '''
+
+    if len(top) < top_k:
+        heapq.heappush(top, cand)
+    elif cand > top[0]: # ties on score go to the earlier entry, as -entry is larger
+        heapq.heapreplace(top, cand)
+
+def top_single_byte_xor(ciph_lst, top_k=1, start=0, printable_only=True, model=default_model):
+    '''
+    Breaks each ciphertext as single byte XOR and keeps the top_k best scoring ones.
+    Uses the pruned search of single_byte_xor_break: only keys giving printable plaintext
+    are scored. With printable_only a ciphertext no key decrypts to printable bytes (most
+    random snippets) ranks below every ciphertext that has a printable decryption, so its
+    keys are only scored, all 256 of them, if fewer than top_k of those are found.
+    No ciphertext is dropped, so up to top_k candidates always come back.
+
+    Inputs
+
+        ciph_lst - iterable(bytestring) - Ciphertexts
+        top_k - int - Number of candidates to keep - default=1
+        start - int - Entry index of the first ciphertext - default=0
+        printable_only - bool - Rank ciphertexts with no printable decryption last - default=True
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model
+
+    Outputs
+
+        top - list - Min-heap of candidates (printable, score, -entry, key, msg), printable is
+                     0 for ciphertexts ranked last, else 1
+    '''
+
+    top = []
+    rest = [] # (entry, ciphertext) with no printable decryption, until top_k printable ones are found
+    for entry, b_cipher in enumerate(ciph_lst, start):
+        keys = printable_keys(b_cipher)
+        if not keys and printable_only:
+            if len(top) < top_k:
+                rest.append((entry, b_cipher))
+            continue
+        best = single_byte_xor_break(b_cipher, keys=keys or range(256), model=model)
+        push_top(top, top_k, (1, best['score'], -entry, best['key'], best['message']))
+
+    if len(top) < top_k:
+        for entry, b_cipher in rest:
+            best = single_byte_xor_break(b_cipher, keys=range(256), model=model)
+            push_top(top, top_k, (0, best['score'], -entry, best['key'], best['message']))
+    return top
+
+def hex_line_to_bytes(line):
+    '''
+    Decodes one line of hex (str or bytes, with or without trailing newline) to a bytestring
+    '''
+
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode('ascii')
+    return bytes.fromhex(line.strip())
+
+def top_single_byte_xor_hex(lines, top_k, start, model=default_model):
+    '''
+    Worker for stream_detect_single_byte_xor - decodes a chunk of hex lines and scores it
+    '''
+
+    return top_single_byte_xor(map(hex_line_to_bytes, lines), top_k, start, model=model)
+
+def pool_top_k(chunks, score_chunk, top_k=1, workers=None, size=len):
+    '''
+    Scores a stream of chunks of records on a process pool and merges the per-chunk top_k
+    heaps into one running top_k heap. At most 2*workers chunks are in flight at a time, so
+    memory stays bounded however long the stream is.
+
+    Inputs
+
+        chunks - iterable - Chunks of records, read lazily
+        score_chunk(chunk, top_k, start) - func pointer - Module level function returning the top_k
+                                           heap of a chunk whose first record has index start
+        top_k - int - Number of best candidates to keep - default=1
+        workers - int - Number of worker processes, 1 scores in this process - default=os.cpu_count()
+        size(chunk) - func pointer - Number of records in a chunk - default=len
+
+    Outputs
+
+        top - list - Min-heap of the top_k candidates
+        rate - float - Records processed per second
+    '''
+
+    workers = workers or os.cpu_count() or 1
+    top = []
+    processed = 0
+    start_time = time.perf_counter()
+
+    if workers == 1:
+        for chunk in chunks:
+            for cand in score_chunk(chunk, top_k, processed):
+                push_top(top, top_k, cand)
+            processed += size(chunk)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            pending = set()
+            for chunk in chunks:
+                if len(pending) >= 2 * workers: # bound the number of chunks held in memory
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        for cand in fut.result():
+                            push_top(top, top_k, cand)
+                pending.add(pool.submit(score_chunk, chunk, top_k, processed))
+                processed += size(chunk)
+            for fut in pending:
+                for cand in fut.result():
+                    push_top(top, top_k, cand)
+
+    elapsed = time.perf_counter() - start_time
+    rate = processed / elapsed if elapsed > 0 else float('inf')
+
+    return top, rate
+
+def detect_single_byte_xor(ciph_lst, model=default_model):
     '''
     Detect the ciphertext most probably encrypted using single byte XOR
 
     Inputs
 
         ciph_lst - list(bytestring) - List of ciphertexts
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model
 
     Outputs
 
-        best_score - list()
+        best_score - list(msg, score, entry, key) - Plaintext, its score, index of the ciphertext and key
     '''
 
-    max_score = -256
-    for entry in range(len(ciph_lst)): # Iterate over all ciphertexts
+    top = top_single_byte_xor(ciph_lst, model=model)
+    printable, max_score, neg_entry, max_key, max_msg = top[0]
 
-        b_cipher = ciph_lst[entry]
+    best_score = [max_msg, max_score, -neg_entry, max_key]
+    return best_score
 
-        best_score_here = -256
-    
-        for j in range(256): # Break each ciphertext and score with letter frequency analysis
-            b_xor_msg = single_char_xor(b_cipher, j)
-            score = get_english_score(b_xor_msg)
-            data = {'message':b_xor_msg, 'score':score, 'key':j}
-            if score > best_score_here: # Store the top scoring key and its params
-                best_score_here = score
-                best_data = data
-    
-        best_score = best_data
-        if best_score['score'] > max_score: # If current message is best, store it
-            max_score = best_score['score']
-            max_msg = best_score['message']
-            max_entry = entry
-            max_key = best_score['key']
+def stream_detect_single_byte_xor(source, top_k=1, workers=None, chunk_size=1024, model=default_model):
+    '''
+    Detect the ciphertexts most probably encrypted using single byte XOR among hex encoded lines,
+    reading lines lazily and scoring them in chunks on a process pool. Lines with no printable
+    decryption rank last, see top_single_byte_xor. Only a bounded number
+    of chunks is in flight at a time, and only the running top_k candidates are kept, so memory
+    does not grow with the size of the input.
 
-    best_score = [max_msg, max_score, max_entry, max_key]
-    return best_score
+    Inputs
+
+        source - string/iterable - Path of a file with one hex ciphertext per line, or an iterable of hex lines
+        top_k - int - Number of best candidates to return - default=1
+        workers - int - Number of worker processes, 1 scores in this process - default=os.cpu_count()
+        chunk_size - int - Number of lines sent to a worker at a time - default=1024
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model
+
+    Outputs
+
+        best_lst - list(list(msg, score, entry, key)) - Top candidates, best first
+        rate - float - Candidates processed per second
+    '''
+
+    if isinstance(source, str): # memory-mapped, lines are only copied out to be sent to workers
+        with mapped(source) as mm:
+            lines = (bytes(line) for line in iter_lines(mm))
+            return stream_detect_single_byte_xor(lines, top_k, workers, chunk_size, model)
+
+    lines = iter(source)
+    chunks = iter(lambda: list(islice(lines, chunk_size)), [])
+    # default_model is left out of the tasks, so workers use their own copy and its integer tables
+    score_chunk = top_single_byte_xor_hex if model is default_model else partial(top_single_byte_xor_hex, model=model)
+    top, rate = pool_top_k(chunks, score_chunk, top_k, workers)
+
+    best_lst = [[msg, score, -neg_entry, key] for printable, score, neg_entry, key, msg in sorted(top, reverse=True)]
+    return best_lst, rate
 
 def main():
-    ciph_lst = [bytes.fromhex(line.strip()) for line in open("p04_in.txt")]
-    best_score = detect_single_byte_xor(ciph_lst)
+    best_lst, rate = stream_detect_single_byte_xor("p04_in.txt")
+    best_score = best_lst[0]
 
     print("Best message: ", best_score[0])
     print("Score: ", best_score[1])
     print("Entry index: ", best_score[2])
     print("Key: ", chr(best_score[3]))
+    print("Candidates per second: ", round(rate))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,6 @@
 ## S1C05 - Repeating key XOR implementation
 
-from p02 import byte_xor
+from p02 import cyclic_xor_into
 
 def rep_key_xor(msg, key):
     '''
@@ -19,10 +19,10 @@ def rep_key_xor(msg, key):
     '''
     #print("p5 msg: ", msg)
     #print("p5 key: ", key)
-    keystr = ((len(msg)//len(key)) + 1) * key
-    keystr = keystr[:len(msg)]
+    out = bytearray(len(msg))
+    cyclic_xor_into(out, msg, key)
 
-    return byte_xor(msg, keystr)
+    return bytes(out)
 
 def main():
     msg = "Burning 'em, if you ain't quick and nimble\nI go crazy when I hear a cymbal"
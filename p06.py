@@ -1,9 +1,28 @@
 ## S1C06 - Breaking Repeating Key XOR
 
 import base64
+import os
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import combinations
 from p05 import rep_key_xor
-from p03 import single_byte_xor_break, single_char_xor, get_english_score
+from p03 import single_byte_xor_break, single_char_xor, get_english_score, key_score_table, rejected_masks
+from p03 import best_count_keys, printable_keys
+from scoring import default_model
+from datafiles import load_bytes
+
+try:
+    import numpy as np
+except ImportError: # the matrix engine is optional, columns are then solved one by one
+    np = None
+
+if np is not None:
+    # score_matrix[c, k] - scaled score of ciphertext byte c under key k, see p03.key_score_table
+    score_matrix = np.array(key_score_table, dtype=np.int64).T.copy()
+    # rejected_matrix[c, k] - 1 if ciphertext byte c decrypts to a non-printable byte under key k
+    rejected_matrix = np.array([[(rejected_masks[k] >> c) & 1 for k in range(256)] for c in range(256)],
+                               dtype=np.int64)
     
 def hamming(a, b):
     '''
@@ -20,19 +39,41 @@ def hamming(a, b):
         dist - int - bit-level hamming distance between a and b 
     '''
     
-    dist = 0
-
-    for i in range(len(a)):
-        
-        if a[i] != b[i]:  #if characters are unequal
-            xor_ab = bin(a[i] ^ b[i])[2:]  #take bitwise xor of a and b
-            
-            for bit in xor_ab:   # count number of set bits, equal to hamming for that character
-                if bit == '1':
-                    dist+=1
+    n = min(len(a), len(b))
+    xor_ab = int.from_bytes(memoryview(a)[:n], 'little') ^ int.from_bytes(memoryview(b)[:n], 'little')
+    dist = xor_ab.bit_count()  # number of set bits across the whole xor
 
     return dist
 
+def hamming_batch(pairs):
+    '''
+    Computes the bit-level hamming distance of many pairs of buffers in one call.
+    All first halves and all second halves are packed into one big integer each, so a single
+    XOR and popcount per pair replaces a per-byte loop.
+
+    Inputs
+
+        pairs - iterable(tuple(bytestring, bytestring)) - Pairs of equal length buffers
+
+    Outputs
+
+        dists - list(int) - Hamming distance of each pair, in order
+    '''
+
+    pairs = [(memoryview(a), memoryview(b)) for a, b in pairs]
+    lens = [min(len(a), len(b)) for a, b in pairs]
+    xor_all = (int.from_bytes(b''.join(a[:n] for (a, _), n in zip(pairs, lens)), 'little')
+               ^ int.from_bytes(b''.join(b[:n] for (_, b), n in zip(pairs, lens)), 'little'))
+    b_xor_all = xor_all.to_bytes(sum(lens), 'little')
+
+    dists = []
+    pos = 0
+    for n in lens:
+        dists.append(int.from_bytes(b_xor_all[pos:pos + n], 'little').bit_count())
+        pos += n
+
+    return dists
+
 def hamming_test():
 
     x = "this is a test"
@@ -44,7 +85,94 @@ def hamming_test():
     assert hamming(b_x, b_y) == 37, "hamming sample test failed"
     print("hamming sample test passed")
 
-def guess_key_length(ciph, lo, hi):
+def key_length_scores(ciph, lo, hi, stat='hamming'):
+    '''
+    Scores every candidate key length between lower and upper limits over the whole ciphertext.
+    'hamming' and 'autocorr' compare ciph with itself shifted by the candidate length, which
+    covers all adjacent blocks at every alignment in one big-integer XOR per length.
+    Lower scores mean more probable key lengths.
+
+    Inputs
+
+        ciph - bytestring - ciphertext encrypted using Repeating Key XOR
+        lo - int - lower limit of key length
+        hi - int - upper limit of key length
+        stat - string - Statistic used - default='hamming'
+            'hamming' - mean bit-level hamming distance per byte between adjacent blocks
+            'autocorr' - negated fraction of bytes equal to the byte one key length further on
+            'ioc' - negated mean index of coincidence of the columns ciph[i::length],
+                    counted with column_histograms when NumPy is available
+
+    Outputs
+
+        scores - dict(int, float) - Score of each candidate key length
+    '''
+
+    assert lo <= len(ciph)//2, "Lower limit of key length too high"
+
+    ciph = bytes(ciph)
+    n = len(ciph)
+    r = min(hi, n//2) # keylen assumed to be not longer than half the length of ciphertext
+    ciph_int = int.from_bytes(ciph, 'little')
+    scores = {}
+
+    for curr in range(lo, r+1):
+        if stat == 'hamming':
+            # the top curr bytes of the xor are ciph's own last bytes, not a comparison
+            xor_shift = ciph_int ^ (ciph_int >> (8*curr))
+            dist = xor_shift.bit_count() - int.from_bytes(ciph[n-curr:], 'little').bit_count()
+            scores[curr] = dist / (n-curr)
+        elif stat == 'autocorr':
+            xor_shift = ciph_int ^ (ciph_int >> (8*curr))
+            matches = xor_shift.to_bytes(n, 'little').count(0) - ciph[n-curr:].count(0)
+            scores[curr] = -matches / (n-curr)
+        elif stat == 'ioc' and np is not None:
+            # coincident pairs of every column from one set of column histograms
+            hist = column_histograms(ciph, curr)
+            coincident = (hist * (hist - 1)).sum(axis=1).tolist()
+            ioc = 0
+            for i in range(curr):
+                col_len = (n - i + curr - 1) // curr
+                pairs = col_len * (col_len-1)
+                ioc += coincident[i] / pairs if pairs else 0
+            scores[curr] = -ioc / curr
+        elif stat == 'ioc':
+            ioc = 0
+            for i in range(curr):
+                col = ciph[i::curr]
+                pairs = len(col) * (len(col)-1)
+                ioc += sum([c * (c-1) for c in Counter(col).values()]) / pairs if pairs else 0
+            scores[curr] = -ioc / curr
+        else:
+            raise ValueError("Unknown key length statistic: {}".format(stat))
+
+    return scores
+
+def fold_key_length(scores, length):
+    '''
+    Whole-ciphertext statistics score every multiple of the true key length about as well as
+    the length itself. Returns the smallest scanned divisor of length whose score is closer
+    to the score of length than to the median score of all lengths, or length itself.
+
+    Inputs
+
+        scores - dict(int, float) - Output of key_length_scores
+        length - int - Candidate key length
+
+    Outputs
+
+        length - int - Smallest equally probable key length
+    '''
+
+    base = statistics.median(scores.values())
+    for d in sorted(scores):
+        if d >= length:
+            break
+        if length % d == 0 and scores[d] - scores[length] < (base - scores[length]) / 2:
+            return d
+    return length
+
+def guess_key_length(ciph, lo, hi, stat='pairs'):
     '''
     Takes a message and guesses the length (between lower and upper limits) of the key in Repeating Key XOR cipher.
     More probable keys have lesser hamming distance across consecutive blocks.
@@ -54,12 +182,23 @@ def guess_key_length(ciph, lo, hi):
         ciph - bytestring - ciphertext encrypted using Repeating Key XOR
         lo - int - lower limit of key length
         hi - int - upper limit of key length
+        stat - string - 'pairs' compares the first 4 blocks only, any other value is a
+                        whole-ciphertext statistic of key_length_scores - default='pairs'
 
     Outputs
 
         top_lens - int - top 3 most probable key lengths
     '''
 
+    if stat != 'pairs':
+        scores = key_length_scores(ciph, lo, hi, stat)
+        top_lens = []
+        for curr in sorted(scores, key=scores.get):
+            curr = fold_key_length(scores, curr)
+            if curr not in top_lens:
+                top_lens.append(curr)
+        return top_lens[:3]
+
     assert lo <= len(ciph)//2, "Lower limit of key length too high"
 
     l = lo
@@ -69,8 +208,7 @@ def guess_key_length(ciph, lo, hi):
         chunks = [ciph[i:i + curr] for i in range(0, len(ciph), curr)][:4]
         dist_here = 0
         pairs = combinations(chunks, 2)
-        for (x, y) in pairs:
-            dist_here += hamming(x, y)
+        dist_here += sum(hamming_batch(pairs))
 
         dist_here /= 6 # 4c2 is 6
         dist_here_norm = dist_here/curr
@@ -80,7 +218,49 @@ def guess_key_length(ciph, lo, hi):
 
     return top_lens # top 3 most probable key lengths
 
-def guess_key(ciph, keylen):
+worker_ciph = b'' # ciphertext shared with pool workers, set once per worker by set_worker_ciph
+worker_model = default_model # scoring model of the pool workers, only sent when not the default
+
+def set_worker_ciph(ciph, model=default_model):
+    '''
+    Process pool initializer - stores the ciphertext and model so column tasks only carry their indices
+    '''
+
+    global worker_ciph, worker_model
+    worker_ciph = ciph
+    worker_model = model
+
+def solve_key_column(keylen, i, ciph=None, model=default_model):
+    '''
+    Breaks the i'th column of a Repeating Key XOR ciphertext, taken as a zero-copy strided
+    view ciph[i::keylen], as a Single Byte XOR cipher
+
+    Inputs
+
+        keylen - int - Length of key
+        i - int - Column index
+        ciph - bytestring - Ciphertext - default=ciphertext of this pool worker
+        model - dict - Compiled scoring model, see scoring.compile_model - default=default_model,
+                       or the model of this pool worker when ciph is not given
+
+    Outputs
+
+        key_byte - int - Most probable i'th key byte
+    '''
+
+    if ciph is None:
+        ciph, model = worker_ciph, worker_model
+    return single_byte_xor_break(memoryview(ciph)[i::keylen], model=model)['key']
+
+def worker_initargs(ciph, model):
+    '''
+    Returns the set_worker_ciph arguments of a pool. default_model is left out, so workers keep
+    their own copy and single_byte_xor_break still recognizes it.
+    '''
+
+    return (ciph,) if model is default_model else (ciph, model)
+
+def guess_key(ciph, keylen, workers=1, model=default_model):
     '''
     Guesses the most probable keys of length keylen for the ciphertext encrypted
     using Repeating Key XOR.
@@ -89,6 +269,10 @@ def guess_key(ciph, keylen):
 
         ciph - bytestring - Ciphertext encrypted using Repeating Key XOR
         keylen - int - Length of key
+        workers - int - Number of worker processes solving columns, 1 solves them in this process.
+                        Unused when NumPy is available, the matrix engine is faster - default=1
+        model - dict - Compiled scoring model, see scoring.compile_model. The matrix engine
+                       only scores default_model - default=default_model
     
     Outputs
 
@@ -96,47 +280,510 @@ def guess_key(ciph, keylen):
     '''
 
     poss_mess = []
-    key = b''
-    for i in range(keylen):  # Making keylen blocks, i'th block containing i'th byte of each of previous blocks.
-        curr_block = b''
-        for j in range(i, len(ciph), keylen):
-            curr_block += bytes([ciph[j]])
-        key += bytes([single_byte_xor_break(curr_block)['key']])
+    ciph = bytes(ciph)
+    if np is not None and model is default_model:
+        key = matrix_keys(ciph, [keylen])[keylen]
+    elif workers == 1:
+        key = bytes([solve_key_column(keylen, i, ciph, model) for i in range(keylen)])
+    else:
+        with ProcessPoolExecutor(workers, initializer=set_worker_ciph, initargs=worker_initargs(ciph, model)) as pool:
+            key = bytes(pool.map(solve_key_column, [keylen] * keylen, range(keylen)))
 
     poss_mess.append((rep_key_xor(ciph, key), key))
     return poss_mess
 
+def column_histograms(ciph, keylen, chunk_size=1 << 16):
+    '''
+    Computes the 256 bin byte histogram of every column ciph[i::keylen] with one bincount per
+    chunk. The column index is folded into the bin (i*256 + byte) so a single bincount does all
+    columns. Bins are built a chunk of whole rows at a time, as uint16 where they fit, so the
+    working memory stays a few chunk_size arrays instead of an intp copy of the ciphertext.
+
+    Inputs
+
+        ciph - bytestring - Ciphertext encrypted using Repeating Key XOR
+        keylen - int - Length of key
+        chunk_size - int - Ciphertext bytes binned at a time - default=65536
+
+    Outputs
+
+        hist - numpy.ndarray - (keylen, 256) array, hist[i, b] is the count of byte b in column i
+    '''
+
+    arr = np.frombuffer(ciph, dtype=np.uint8)
+    step = max(chunk_size - chunk_size % keylen, keylen) # whole rows, so every chunk starts at column 0
+    bins = np.arange(keylen, dtype=np.uint16 if keylen <= 256 else np.uint32) * 256
+    bins = np.tile(bins, -(-min(step, len(arr)) // keylen))
+    hist = np.zeros(keylen*256, dtype=np.intp)
+    for start in range(0, len(arr), step):
+        chunk = arr[start:start+step]
+        hist += np.bincount(chunk + bins[:len(chunk)], minlength=keylen*256)
+    return hist.reshape(keylen, 256)
+
+def fold_histograms(hist, keylen):
+    '''
+    Returns the column histograms for a key length dividing hist's, by summing the columns
+    that fall on the same key byte - column j of keylen holds columns j, j+keylen, ... of hist
+    '''
+
+    return hist.reshape(-1, keylen, 256).sum(axis=0)
+
+def histogram_key(hist, ciph, keylen):
+    '''
+    Scores all 256 keys for all columns with one matrix multiply against the score table and
+    returns the best key byte of each column, exactly as single_byte_xor_break would: keys
+    giving non-printable bytes are dropped where any key survives, and exact score ties are
+    settled by single_byte_xor_break itself on that column.
+
+    Inputs
+
+        hist - numpy.ndarray - (keylen, 256) column histograms, see column_histograms
+        ciph - bytestring - Ciphertext, only read for tied columns
+        keylen - int - Length of key
+
+    Outputs
+
+        key - bytestring - Most probable key
+    '''
+
+    scores = hist @ score_matrix
+    allowed = ((hist > 0).astype(np.int64) @ rejected_matrix) == 0
+    prune = allowed.any(axis=1, keepdims=True)
+    scores = np.where(allowed | ~prune, scores, -1)
+
+    best = scores.max(axis=1, keepdims=True)
+    key = scores.argmax(axis=1)
+    for i in np.flatnonzero((scores == best).sum(axis=1) > 1):
+        tied = np.flatnonzero(scores[i] == best[i]).tolist()
+        key[i] = single_byte_xor_break(memoryview(ciph)[i::keylen], keys=tied)['key']
+    return bytes(key.astype(np.uint8))
+
+def matrix_keys(ciph, key_lens):
+    '''
+    Finds the full key for every candidate key length with the NumPy matrix engine.
+    Lengths are done longest first, and a length dividing one already done reuses its
+    histograms (see fold_histograms) instead of reading the ciphertext again.
+
+    Inputs
+
+        ciph - bytestring - Ciphertext encrypted using Repeating Key XOR
+        key_lens - iterable(int) - Candidate key lengths
+
+    Outputs
+
+        keys - dict(int, bytestring) - Most probable key of each length
+    '''
+
+    ciph = bytes(ciph)
+    hists = {}
+    keys = {}
+    for keylen in sorted(set(key_lens), reverse=True):
+        multiple = next((done for done in hists if done % keylen == 0), None)
+        hist = column_histograms(ciph, keylen) if multiple is None else fold_histograms(hists[multiple], keylen)
+        hists[keylen] = hist
+        keys[keylen] = histogram_key(hist, ciph, keylen)
+    return keys
+
+def english_confidence(msg, model=default_model):
+    '''
+    Returns the english score of msg per byte under model, comparable across message lengths
+    '''
+
+    return get_english_score(msg, model) / len(msg) if msg else 0
+
 def b64_to_bytes(b64_msg):
     return base64.b64decode(b64_msg)
 
-def break_repeating_key_xor(ciph, lo, hi):
+def break_repeating_key_xor(ciph, lo, hi, stat='pairs', workers=1, confidence=None, model=default_model):
     '''
     Finds the original message by choosing most probable key lengths and then breaking it
     using the technique for breaking Single Byte XOR for each byte in key.
+    With NumPy and default_model all candidate lengths are solved in this process by the matrix
+    engine (see matrix_keys). Otherwise, with workers > 1, the columns of all candidate lengths are solved
+    concurrently on a process pool, likeliest length first. Starting the pool costs more than
+    solving a few KB, so it only pays off for large ciphertexts.
 
     Inputs
 
         ciph - bytestring - ciphertext encrypted using Repeating Key XOR
         lo - int - lower limit of key length
         hi - int - upper limit of key length
+        stat - string - Key length statistic, see guess_key_length - default='pairs'
+        workers - int - Number of worker processes, 1 solves in this process, None for
+                        os.cpu_count() - default=1
+        confidence - float - Return the first candidate, in key_lens order, whose english_confidence
+                             reaches this, without solving the lengths after it - default=None (never)
+        model - dict - Compiled scoring model for the key bytes, confidence and the final choice,
+                       see scoring.compile_model - default=default_model
 
     Outputs
 
         b_msg - tuple(bytestring, bytestring) - tuple of most probable message and key
     '''
-    candidates = []
-    key_lens = guess_key_length(ciph, lo, hi)
-    for length in key_lens:
-        candidates.extend(guess_key(ciph, length))
+    ciph = bytes(ciph)
+    workers = workers or os.cpu_count() or 1
+    candidates = {}
+    key_lens = guess_key_length(ciph, lo, hi, stat)
+
+    matrix = np is not None and model is default_model
+    if workers == 1 or matrix:
+        keys = matrix_keys(ciph, key_lens) if matrix else {}
+        for length in key_lens:
+            candidates[length] = (rep_key_xor(ciph, keys[length]), keys[length]) if keys else guess_key(ciph, length, 1, model)[0]
+            if confidence is not None and english_confidence(candidates[length][0], model) >= confidence:
+                return candidates[length]
+    else:
+        with ProcessPoolExecutor(workers, initializer=set_worker_ciph, initargs=worker_initargs(ciph, model)) as pool:
+            columns = {}
+            for length in key_lens:
+                for i in range(length):
+                    columns[pool.submit(solve_key_column, length, i)] = (length, i)
+
+            key_bytes = {length: [None] * length for length in key_lens}
+            left = {length: length for length in key_lens}
+            checked = 0 # key_lens[:checked] are solved and below confidence
+            for fut in as_completed(columns):
+                length, i = columns[fut]
+                key_bytes[length][i] = fut.result()
+                left[length] -= 1
+                if left[length]: # this length still has unsolved columns
+                    continue
+
+                key = bytes(key_bytes[length])
+                candidates[length] = (rep_key_xor(ciph, key), key)
+                if confidence is None:
+                    continue
+                # a likelier length may still be running, so only check in key_lens order
+                while checked < len(key_lens) and key_lens[checked] in candidates:
+                    if english_confidence(candidates[key_lens[checked]][0], model) >= confidence:
+                        pool.shutdown(cancel_futures=True)
+                        return candidates[key_lens[checked]]
+                    checked += 1
+
+    return max([candidates[length] for length in key_lens], key=lambda k: get_english_score(k[0], model))
+
+
+def column_counts(ciph, keylen):
+    '''
+    Returns the byte histogram of each column ciph[i::keylen] of a Repeating Key XOR ciphertext
+    '''
+
+    b_ciph = memoryview(ciph)
+    return [Counter(b_ciph[i::keylen]) for i in range(keylen)]
+
+def column_coincidence(counts, pooled):
+    '''
+    Returns the mean probability, over all columns, that a byte drawn from a column of counts
+    equals a byte drawn from the same column of pooled. Two ciphertexts under the same key
+    coincide about as often as english text with itself (~0.07); under different keys the
+    columns are XOR-ed with different bytes and coincide far less.
+
+    Inputs
+
+        counts - list(Counter) - Column histograms of one ciphertext, see column_counts
+        pooled - list(Counter) - Column histograms pooled over a cluster, same number of columns
+
+    Outputs
+
+        coincidence - float - Mean cross coincidence of the columns
+    '''
+
+    total = 0
+    cols = 0
+    for col, pool_col in zip(counts, pooled):
+        n, pool_n = sum(col.values()), sum(pool_col.values())
+        if n and pool_n:
+            total += sum([c * pool_col[byte] for byte, c in col.items()]) / (n * pool_n)
+            cols += 1
+    return total / cols if cols else 0
+
+def fold_key(key):
+    '''
+    Returns the shortest key whose repetition gives key, e.g. b"ICEICE" -> b"ICE"
+    '''
+
+    for d in range(1, len(key)):
+        if len(key) % d == 0 and key == key[:d] * (len(key) // d):
+            return key[:d]
+    return key
+
+def cluster_by_key(ciph_lst, lo, hi, threshold=0.045):
+    '''
+    Groups ciphertexts that were probably encrypted under the same Repeating Key XOR key.
+    Longest ciphertexts go first, as their key length guesses are the most reliable. Each
+    ciphertext joins the cluster whose pooled column histograms, at that cluster's key length,
+    it coincides with most (see column_coincidence), if that reaches threshold. Otherwise it
+    starts a new cluster at its own most probable key length.
+    Short ciphertexts can misjudge that length and split a key into several clusters, so
+    clusters are then merged, smallest first, into larger ones they coincide with.
+
+    Inputs
+
+        ciph_lst - list(bytestring) - Ciphertexts, each encrypted from the start of its key
+        lo - int - lower limit of key length
+        hi - int - upper limit of key length
+        threshold - float - Least column coincidence for joining a cluster - default=0.045
+
+    Outputs
+
+        clusters - list(dict(keylen, entries, counts)) - Key length, indices of the member
+                   ciphertexts and pooled column histograms of each cluster
+    '''
+
+    clusters = []
+    for entry in sorted(range(len(ciph_lst)), key=lambda j: -len(ciph_lst[j])):
+        ciph = ciph_lst[entry]
+        counts_at = {}
+        best, best_sim = None, threshold
+        for cluster in clusters:
+            keylen = cluster['keylen']
+            if keylen not in counts_at:
+                counts_at[keylen] = column_counts(ciph, keylen)
+            sim = column_coincidence(counts_at[keylen], cluster['counts'])
+            if sim >= best_sim:
+                best, best_sim = cluster, sim
+
+        if best is None:
+            keylen = guess_key_length(ciph, lo, hi, 'hamming')[0] if len(ciph) // 2 >= lo else lo
+            best = {'keylen': keylen, 'entries': [], 'counts': [Counter() for i in range(keylen)]}
+            clusters.append(best)
+            counts_at[keylen] = column_counts(ciph, keylen)
+        best['entries'].append(entry)
+        for pool_col, col in zip(best['counts'], counts_at[best['keylen']]):
+            pool_col.update(col)
+
+    merged = []
+    for cluster in sorted(clusters, key=lambda c: -len(c['entries'])):
+        best, best_sim = None, threshold
+        for big in merged:
+            counts = [Counter() for i in range(big['keylen'])]
+            for entry in cluster['entries']:
+                for pool_col, col in zip(counts, column_counts(ciph_lst[entry], big['keylen'])):
+                    pool_col.update(col)
+            sim = column_coincidence(counts, big['counts'])
+            if sim >= best_sim:
+                best, best_sim, best_counts = big, sim, counts
+        if best is None:
+            merged.append(cluster)
+            continue
+        best['entries'] += cluster['entries']
+        for pool_col, col in zip(best['counts'], best_counts):
+            pool_col.update(col)
+
+    return merged
+
+def solve_cluster_key(columns):
+    '''
+    Breaks the key of a cluster from its columns, each pooled over all member ciphertexts
+
+    Inputs
+
+        columns - list(bytestring) - i'th column of every member, joined, for each key byte i
+
+    Outputs
+
+        key - bytestring - Most probable key
+    '''
+
+    return bytes([single_byte_xor_break(col)['key'] for col in columns])
+
+def break_repeating_key_xor_batch(ciph_lst, lo, hi, workers=None, threshold=0.045):
+    '''
+    Breaks a corpus of Repeating Key XOR ciphertexts, many of them sharing keys. Ciphertexts are
+    clustered by key (see cluster_by_key), and each key is solved once from the columns of all
+    its ciphertexts together, so messages too short to break alone are broken as a group.
+    Clusters are solved concurrently on a process pool.
+
+    Inputs
+
+        ciph_lst - list(bytestring) - Ciphertexts, each encrypted from the start of its key
+        lo - int - lower limit of key length
+        hi - int - upper limit of key length
+        workers - int - Number of worker processes, 1 solves in this process - default=os.cpu_count()
+        threshold - float - Least column coincidence for joining a cluster - default=0.045
+
+    Outputs
+
+        results - list(dict(key, entries, confidence)) - One result per cluster, largest first:
+                  its key, the indices of its ciphertexts and the english_confidence of their plaintext
+    '''
+
+    ciph_lst = [bytes(ciph) for ciph in ciph_lst]
+    workers = workers or os.cpu_count() or 1
+    clusters = sorted(cluster_by_key(ciph_lst, lo, hi, threshold), key=lambda c: -len(c['entries']))
+    columns = [[b''.join([ciph_lst[j][i::cluster['keylen']] for j in cluster['entries']])
+                for i in range(cluster['keylen'])] for cluster in clusters]
+
+    if workers == 1:
+        keys = list(map(solve_cluster_key, columns))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            keys = list(pool.map(solve_cluster_key, columns))
+
+    results = []
+    for cluster, key in zip(clusters, keys):
+        msg = b''.join([rep_key_xor(ciph_lst[j], key) for j in cluster['entries']])
+        results.append({'key': fold_key(key), 'entries': sorted(cluster['entries']),
+                        'confidence': english_confidence(msg)})
+
+    return results
+
+def online_state(lo, hi):
+    '''
+    Returns the empty state of an online Repeating Key XOR breaker, see online_update
+
+    Inputs
+
+        lo - int - lower limit of key length
+        hi - int - upper limit of key length
+
+    Outputs
+
+        state - dict - Bytes seen so far (n), the last hi bytes (tail) and, for each candidate
+                       length, the running hamming distance and equal byte count between bytes
+                       one length apart, the column histograms and their coincident pairs
+    '''
+
+    lengths = range(lo, hi+1)
+    return {'lo': lo, 'hi': hi, 'n': 0, 'tail': b'',
+            'hamming': dict.fromkeys(lengths, 0), 'matches': dict.fromkeys(lengths, 0),
+            'counts': {length: [Counter() for i in range(length)] for length in lengths},
+            'coincident': {length: [0] * length for length in lengths}}
+
+def online_update(state, chunk):
+    '''
+    Adds the next chunk of a ciphertext stream to the state of an online breaker, in
+    O(len(chunk)) per candidate length, touching only the min(length, len(chunk)) columns
+    that receive bytes. Earlier data is never read again, only the last hi bytes are kept
+    for comparisons that span chunks.
+
+    Inputs
+
+        state - dict - State from online_state, updated in place
+        chunk - bytestring - Next ciphertext bytes
+    '''
+
+    chunk = bytes(chunk)
+    if not chunk:
+        return
+    n, tail = state['n'], state['tail']
+    window = tail + chunk
+
+    for length, cols in state['counts'].items():
+        # ---Adjacent blocks--- byte p against byte p-length, for the new bytes p >= length
+        skip = max(0, length - n)
+        if skip < len(chunk):
+            new, old = chunk[skip:], window[len(tail) - length + skip:len(tail) - length + len(chunk)]
+            xor_shift = int.from_bytes(new, 'little') ^ int.from_bytes(old, 'little')
+            state['hamming'][length] += xor_shift.bit_count()
+            state['matches'][length] += xor_shift.to_bytes(len(new), 'little').count(0)
+
+        # ---Columns--- byte p goes to column p % length, adding c*(2*old + c - 1) coincident pairs.
+        # Only the first min(length, len(chunk)) offsets of the chunk start a non-empty column.
+        coincident = state['coincident'][length]
+        for off in range(min(length, len(chunk))):
+            i = (n + off) % length
+            col = cols[i]
+            for byte, c in Counter(chunk[off::length]).items():
+                old = col[byte]
+                coincident[i] += c * (2*old + c - 1)
+                col[byte] = old + c
+
+    state['n'] = n + len(chunk)
+    state['tail'] = window[-state['hi']:]
+
+def online_scores(state, stat='hamming'):
+    '''
+    Returns the key length scores of the data seen so far, lower is more probable, on the same
+    scale as key_length_scores
+
+    Inputs
+
+        state - dict - State from online_state
+        stat - string - 'hamming', 'autocorr' or 'ioc', see key_length_scores - default='hamming'
+
+    Outputs
+
+        scores - dict(int, float) - Score of each candidate key length with enough data
+    '''
+
+    n = state['n']
+    scores = {}
+    for length in state['counts']:
+        if length > n // 2: # keylen assumed to be not longer than half the length of ciphertext
+            continue
+        if stat == 'hamming':
+            scores[length] = state['hamming'][length] / (n - length)
+        elif stat == 'autocorr':
+            scores[length] = -state['matches'][length] / (n - length)
+        elif stat == 'ioc':
+            ioc = 0
+            for i, coincident in enumerate(state['coincident'][length]):
+                col_n = n//length + (i < n % length)
+                ioc += coincident / (col_n * (col_n-1)) if col_n > 1 else 0
+            scores[length] = -ioc / length
+        else:
+            raise ValueError("Unknown key length statistic: {}".format(stat))
+    return scores
+
+def online_best(state, stat='hamming'):
+    '''
+    Publishes the current best key of an online breaker from its running statistics alone
+
+    Inputs
+
+        state - dict - State from online_state
+        stat - string - Key length statistic, see online_scores - default='hamming'
+
+    Outputs
+
+        best - tuple(bytestring, float) - Most probable key so far and the english_confidence of
+               the plaintext it gives, computed from the column histograms (b'', 0) before enough data
+    '''
+
+    scores = online_scores(state, stat)
+    if not scores:
+        return b'', 0
+    length = fold_key_length(scores, min(scores, key=scores.get))
+
+    unigram = default_model['unigram']
+    key = []
+    score = 0
+    for col in state['counts'][length]:
+        keys = best_count_keys(col.items(), printable_keys(col) or range(256))
+        # exact ties are settled by the float score, as single_byte_xor_break does
+        col_scores = [sum([unigram[byte ^ k] * c for byte, c in col.items()]) for k in keys]
+        best = max(range(len(keys)), key=col_scores.__getitem__)
+        key.append(keys[best])
+        score += col_scores[best]
+
+    return bytes(key), score / state['n']
+
+def stream_break_repeating_key_xor(chunks, lo, hi, stat='hamming'):
+    '''
+    Breaks a Repeating Key XOR ciphertext as it arrives, publishing the current best key after
+    every chunk. See online_update and online_best.
+
+    Inputs
+
+        chunks - iterable(bytestring) - Ciphertext stream
+        lo - int - lower limit of key length
+        hi - int - upper limit of key length
+        stat - string - Key length statistic, see online_scores - default='hamming'
+
+    Outputs
+
+        best - tuple(bytestring, float) - Most probable key and its confidence after each chunk
+    '''
 
-    return max(candidates, key=lambda k: get_english_score(k[0]))
+    state = online_state(lo, hi)
+    for chunk in chunks:
+        online_update(state, chunk)
+        yield online_best(state, stat)
      
 def main():
     
-    with open("p06_in.txt") as input_file:
-        cipher = input_file.read()
- 
-    b_cipher = b64_to_bytes(cipher)
+    b_cipher = load_bytes("p06_in.txt", "base64")
     lo = 2
     hi = 40
 
@@ -1,7 +1,26 @@
 ## S1C07 - Decrypting AES ECB with OpenSSL
 
+import sys
+from functools import lru_cache
 from Crypto.Cipher import AES
-from base64 import b64decode
+from datafiles import mapped
+
+@lru_cache(maxsize=256)
+def aes_ecb_context(key):
+    '''
+    Returns an AES-ECB cipher object for key. ECB objects keep no state between calls, so
+    the key is expanded once and the object is reused by every call with the same key.
+
+    Inputs
+
+        key - bytestring - Key (must be hashable, i.e. bytes)
+
+    Outputs
+
+        ciph_obj - Crypto.Cipher AES object - AES-ECB cipher for key
+    '''
+
+    return AES.new(key, AES.MODE_ECB)
 
 def aes_ecb_decrypt(ciph, key):
     '''
@@ -17,16 +36,18 @@ def aes_ecb_decrypt(ciph, key):
         msg - bytestring - Message
     '''
     
-    ciph_obj = AES.new(key, AES.MODE_ECB)
+    ciph_obj = aes_ecb_context(bytes(key))
     return ciph_obj.decrypt(ciph)
 
 def main():
-    with open("p07_in.txt") as input_file:
-        ciph = b64decode(input_file.read())
+    from p10 import aes_stream_decrypt # p10 builds on this module, so import it late
 
     key = "YELLOW SUBMARINE"
     b_key = bytes(key, 'utf-8')
-    print(aes_ecb_decrypt(ciph, b_key).decode())
+
+    with mapped("p07_in.txt") as mm:
+        aes_stream_decrypt(mm, sys.stdout.buffer, b_key, "ECB", b64=True)
+    print()
 
 if __name__ == "__main__":
     main()
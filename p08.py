@@ -1,6 +1,9 @@
 ## S1C08 - Detecting AES-ECB
 
+from itertools import islice
 from Crypto.Cipher.AES import block_size
+from p04 import push_top, pool_top_k, hex_line_to_bytes
+from datafiles import mapped, iter_lines
 
 def aes_ecb_repeats(ciph):
     '''
@@ -40,10 +43,90 @@ def detect_aes_ecb(ciph_lst):
 
     return best
 
+def top_aes_ecb(ciph_lst, top_k=1, start=0):
+    '''
+    Counts repeated blocks of each ciphertext and keeps the top_k with the most repeats
+
+    Inputs
+
+        ciph_lst - iterable(bytestring) - Candidate ciphertexts
+        top_k - int - Number of candidates to keep - default=1
+        start - int - Index of the first ciphertext - default=0
+
+    Outputs
+
+        top - list - Min-heap of candidates (reps, -index)
+    '''
+
+    top = []
+    for i, ciph in enumerate(ciph_lst, start):
+        push_top(top, top_k, (aes_ecb_repeats(ciph), -i))
+    return top
+
+def top_aes_ecb_hex(lines, top_k, start):
+    '''
+    Worker for stream_detect_aes_ecb - decodes a chunk of hex lines and counts their repeats
+    '''
+
+    return top_aes_ecb(map(hex_line_to_bytes, lines), top_k, start)
+
+def top_aes_ecb_records(chunk, top_k, start):
+    '''
+    Worker for stream_detect_aes_ecb - counts repeats of fixed length binary records,
+    sliced out of one buffer
+
+    Inputs
+
+        chunk - tuple(int, bytestring) - Record length and a buffer of whole records
+        top_k - int - Number of candidates to keep
+        start - int - Index of the first record
+    '''
+
+    record_len, buf = chunk
+    return top_aes_ecb((buf[i:i + record_len] for i in range(0, len(buf), record_len)), top_k, start)
+
+def stream_detect_aes_ecb(source, top_k=1, workers=None, chunk_size=1024, record_len=None):
+    '''
+    Returns the top_k most probable AES-ECB ciphertexts among a stream of candidates, read lazily
+    and counted in chunks on a process pool (see p04.pool_top_k), so memory stays bounded.
+
+    Inputs
+
+        source - string/file object/iterable - Path or file with one hex ciphertext per line, an
+                 iterable of hex lines, or with record_len a binary file of fixed length records
+        top_k - int - Number of candidates to return - default=1
+        workers - int - Number of worker processes, 1 counts in this process - default=os.cpu_count()
+        chunk_size - int - Number of records sent to a worker at a time - default=1024
+        record_len - int - Length of binary records, None for hex lines - default=None
+
+    Outputs
+
+        best_lst - list(list(int, int)) - Index and repetitions of the top candidates, best first
+        rate - float - Candidates processed per second
+    '''
+
+    if isinstance(source, str): # memory-mapped, hex lines are only copied out to be sent to workers
+        with mapped(source) as mm:
+            records = mm if record_len else (bytes(line) for line in iter_lines(mm))
+            return stream_detect_aes_ecb(records, top_k, workers, chunk_size, record_len)
+
+    if record_len:
+        chunks = ((record_len, buf) for buf in iter(lambda: source.read(record_len * chunk_size), b''))
+        top, rate = pool_top_k(chunks, top_aes_ecb_records, top_k, workers,
+                               size=lambda chunk: -(-len(chunk[1]) // chunk[0]))
+    else:
+        lines = iter(source)
+        chunks = iter(lambda: list(islice(lines, chunk_size)), [])
+        top, rate = pool_top_k(chunks, top_aes_ecb_hex, top_k, workers)
+
+    best_lst = [[-neg_i, reps] for reps, neg_i in sorted(top, reverse=True)]
+    return best_lst, rate
+
 def main():
-    ciph_lst = [bytes.fromhex(line.strip()) for line in open("p08_in.txt")]
-    result = detect_aes_ecb(ciph_lst)
+    best_lst, rate = stream_detect_aes_ecb("p08_in.txt")
+    result = best_lst[0]
     print("Detected probable AES-ECB ciphertext at position", result[0], "with", result[1], "repetitions")
+    print("Candidates per second:", round(rate))
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,8 @@
 ## S2C09 - Implementing PKCS#7 Padding
 
+# pkcs7_pads[n] - the n pad bytes of value n, for every possible pad length
+pkcs7_pads = [bytes([n]) * n for n in range(256)]
+
 def pkcs7pad(msg, b_length):
     '''
     Takes a plaintext and a block length, and returns the plaintext with padding as specified by PKCS#7
@@ -7,20 +10,110 @@ def pkcs7pad(msg, b_length):
     Input
 
         msg - bytestring - Unpadded plaintext
-        b_length - int - Block length in bytes
+        b_length - int - Block length in bytes, 1 to 255
 
     Output
 
         pad_msg - bytestring - PKCS#7 Padded Plaintext
     '''
 
+    if not 0 < b_length < 256:
+        raise ValueError("PKCS#7 block length must be between 1 and 255")
     pad_length = b_length - (len(msg) % b_length)  # number of pad bytes
-    pad_msg = msg
-    pad_bytes = bytes(chr(pad_length), 'utf-8') * pad_length 
-    pad_msg += pad_bytes
+    pad_msg = msg + pkcs7_pads[pad_length]
 
     return pad_msg
 
+def pkcs7pad_into(buf, b_length):
+    '''
+    Pads a bytearray in place as specified by PKCS#7
+
+    Input
+
+        buf - bytearray - Unpadded plaintext, extended in place
+        b_length - int - Block length in bytes, 1 to 255
+
+    Output
+
+        buf - bytearray - The same bytearray, now padded
+    '''
+
+    if not 0 < b_length < 256:
+        raise ValueError("PKCS#7 block length must be between 1 and 255")
+    buf += pkcs7_pads[b_length - (len(buf) % b_length)]
+    return buf
+
+def pkcs7_unpad_len(msg, b_length):
+    '''
+    Validates PKCS#7 padding and returns the length of the plaintext without it. All of the
+    last b_length bytes are always examined and combined without branching on their values,
+    so the time taken does not depend on where or whether the padding is wrong.
+
+    Input
+
+        msg - bytestring/bytearray/memoryview - Padded plaintext
+        b_length - int - Block length in bytes
+
+    Output
+
+        msg_len - int - Length of the plaintext without padding
+
+    Raises ValueError if the padding is invalid
+    '''
+
+    if not 0 < b_length < 256 or len(msg) == 0 or len(msg) % b_length:
+        raise ValueError("Padded length must be a non-zero multiple of the block length")
+
+    pad_length = msg[-1]
+    # (x >> 8) & 1 is 1 exactly when -256 <= x < 0, i.e. here when x is negative
+    bad = ((pad_length - 1) >> 8) & 1 | ((b_length - pad_length) >> 8) & 1  # pad_length == 0 or > b_length
+    for i in range(1, b_length + 1):
+        in_pad = ((i - pad_length - 1) >> 8) & 0xFF # 0xFF for the last pad_length bytes, else 0
+        bad |= (msg[-i] ^ pad_length) & in_pad
+
+    if bad:
+        raise ValueError("Invalid PKCS#7 padding")
+
+    return len(msg) - pad_length
+
+def pkcs7unpad(msg, b_length):
+    '''
+    Validates and strips PKCS#7 padding. A memoryview comes back as a view of the same
+    memory, so nothing is copied.
+
+    Input
+
+        msg - bytestring/bytearray/memoryview - Padded plaintext
+        b_length - int - Block length in bytes
+
+    Output
+
+        unpad_msg - same type as msg - Plaintext without padding
+
+    Raises ValueError if the padding is invalid
+    '''
+
+    return msg[:pkcs7_unpad_len(msg, b_length)]
+
+def pkcs7unpad_into(buf, b_length):
+    '''
+    Validates and strips PKCS#7 padding from a bytearray in place
+
+    Input
+
+        buf - bytearray - Padded plaintext, truncated in place
+        b_length - int - Block length in bytes
+
+    Output
+
+        buf - bytearray - The same bytearray, now without padding
+
+    Raises ValueError if the padding is invalid
+    '''
+
+    del buf[pkcs7_unpad_len(buf, b_length):]
+    return buf
+
 def main():
     msg = "YELLOW SUBMARINE"
     b_msg = bytes(msg, 'utf-8')
@@ -1,11 +1,15 @@
 ## S2C10 - Implement Cipher Block Chaining (CBC) Mode
 
-import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
 from Crypto.Cipher import AES
-from base64 import b64decode
-from p02 import byte_xor
-from p07 import aes_ecb_decrypt
-from p09 import pkcs7pad
+from p02 import xor_into
+from p07 import aes_ecb_context, aes_ecb_decrypt
+from p09 import pkcs7pad, pkcs7unpad
+from datafiles import mapped, read_chunks, b64_decode_chunks, b64_encode_chunks
 
 def aes_ecb_encrypt(msg, key):
     '''
@@ -21,13 +25,14 @@ def aes_ecb_encrypt(msg, key):
         ciph - bytestring - AES-ECB encrypted ciphertext
     '''
 
-    ciph_obj = AES.new(key, AES.MODE_ECB)
+    ciph_obj = aes_ecb_context(bytes(key))
     ciph = ciph_obj.encrypt(msg)
     return ciph
 
-def get_msg_blocks(msg, b_len=16):
+def cbc_pad(msg, b_len=16):
     '''
-    Divides a plaintext into blocks of specified length
+    Pads a plaintext to whole blocks with PKCS#7, as one bytestring.
+    A message that already fills whole blocks is returned as is, without a full pad block.
 
     Inputs
 
@@ -36,12 +41,33 @@ def get_msg_blocks(msg, b_len=16):
 
     Outputs
 
-        blocks - list(bytestring) - List containing blocks of plaintext
+        pad_msg - bytestring - Plaintext padded to a multiple of b_len
     '''
 
-    pad_msg = pkcs7pad(msg, b_len) # pad plaintext to suitable length
-    blocks = [pad_msg[b_len*i:b_len*(i+1)] for i in range(int(math.ceil(len(msg)/b_len)))]
-    return blocks
+    if len(msg) % b_len == 0:
+        return msg
+    return pkcs7pad(msg, b_len)
+
+@lru_cache(maxsize=256)
+def aes_cbc_context(key):
+    '''
+    Returns AES-CBC encryption and decryption objects for key, expanded once and reused by
+    every cbc_encrypt / cbc_decrypt call with that key. A CBC object chains each call on the
+    last ciphertext block it saw, kept here as the chain, so a call with another IV only needs
+    its first block corrected by chain ^ iv. The lock serializes calls from several threads.
+
+    Inputs
+
+        key - bytestring - Key
+
+    Outputs
+
+        ctx - dict(encrypt, decrypt, enc_chain, dec_chain, lock) - Cached CBC context
+    '''
+
+    zero_iv = bytes(AES.block_size)
+    return {'encrypt': AES.new(key, AES.MODE_CBC, iv=zero_iv), 'decrypt': AES.new(key, AES.MODE_CBC, iv=zero_iv),
+            'enc_chain': zero_iv, 'dec_chain': zero_iv, 'lock': threading.Lock()}
 
 def cbc_encrypt(msg, key, b_len=16, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", enc="AES"):
     '''
@@ -61,26 +87,29 @@ def cbc_encrypt(msg, key, b_len=16, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x0
         ciph - bytestring - Ciphertext encrypted with CBC
     '''
 
-    ciph_blocks = []
-    msg_blocks = get_msg_blocks(msg, b_len)
-    prev = iv
-    if enc=="AES":
-        enc_func = aes_ecb_encrypt
-    
-    for m_blk in msg_blocks:
-        cbc_in = byte_xor(m_blk, prev)
-        c_blk = enc_func(cbc_in, key)
-        ciph_blocks.append(c_blk)
-        prev = c_blk
+    if enc != "AES":
+        raise ValueError("Unsupported encryption standard: {}".format(enc))
 
-    ciph = b''.join(ciph_blocks)
+    # CBC encryption chains each block on the previous output, so it runs as one native CBC call
+    # on the cached context, with the first block pre-XOR-ed with chain ^ iv
+    msg = bytearray(cbc_pad(msg, b_len))
+    if not msg:
+        return b''
+    ctx = aes_cbc_context(bytes(key))
+    with ctx['lock']:
+        xor_into(msg, msg, iv)
+        xor_into(msg, msg, ctx['enc_chain'])
+        ciph = ctx['encrypt'].encrypt(msg)
+        ctx['enc_chain'] = ciph[-b_len:]
 
     return ciph
 
-def cbc_decrypt(ciph, key, b_len=16, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", enc="AES"):
+def cbc_decrypt(ciph, key, b_len=16, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", enc="AES", native=True, unpad=False):
     '''
     Decrypts ciphertext with a specified encryption standard in Cipher Block Chaining (CBC) 
-    mode
+    mode. Every plaintext block depends only on ciphertext, so the whole buffer is decrypted
+    at once, either by a native CBC call or by a bulk ECB decryption XOR-ed with the
+    ciphertext shifted by one block. Both reuse the key schedule cached for key.
 
     Inputs
 
@@ -89,35 +118,282 @@ def cbc_decrypt(ciph, key, b_len=16, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x
         b_len - int - Block length - default=16
         iv - bytestring - Initialization Vector for first block - default=b'\x00'*16
         enc - string - Encryption Standard - default="AES"
+        native - bool - Use the native CBC mode, else bulk ECB plus XOR - default=True
+        unpad - bool - Validate and strip PKCS#7 padding, raising ValueError if invalid - default=False
 
     Outputs
 
         msg - bytestring - Plaintext
     '''
     
-    msg_blocks = []
-    ciph_blocks = get_msg_blocks(ciph, b_len)
-    prev = iv
-    if enc=="AES":
-        dec_func = aes_ecb_decrypt
-    
-    for c_blk in ciph_blocks:
-        m_blk = dec_func(c_blk, key)
-        m_blk = byte_xor(m_blk, prev)
-        msg_blocks.append(m_blk)
-        prev = c_blk
+    if enc != "AES":
+        raise ValueError("Unsupported encryption standard: {}".format(enc))
+
+    ciph = cbc_pad(ciph, b_len)
+    if not ciph:
+        msg = b''
+    elif native:
+        ctx = aes_cbc_context(bytes(key))
+        with ctx['lock']:
+            msg = bytearray(ctx['decrypt'].decrypt(ciph))
+            xor_into(msg, msg, ctx['dec_chain']) # the first block was chained on the previous call
+            ctx['dec_chain'] = ciph[-b_len:]
+        xor_into(msg, msg, iv)
+        msg = bytes(msg)
+    else:
+        msg = bytearray(aes_ecb_decrypt(ciph, key))
+        b_msg = memoryview(msg)
+        xor_into(b_msg, b_msg, iv)  # first block chains on the IV
+        xor_into(b_msg[b_len:], b_msg[b_len:], memoryview(ciph)[:-b_len])  # the rest on the previous ciphertext block
+        msg = bytes(msg)
 
-    msg = b''.join(msg_blocks)
+    if unpad:
+        msg = pkcs7unpad(msg, b_len)
 
     return msg
 
-def main():
-    with open("p10_in.txt") as input_file:
-        ciph = b64decode(input_file.read())
+def aes_batch_task(key, items, mode, decrypt, b_len=16, out=None):
+    '''
+    Worker for aes_batch - encrypts or decrypts records sharing one key, back to back.
+    ECB, and CBC decryption, run as one native ECB call over all the records with the cached
+    key schedule; CBC decryption then XORs every block with the IV or previous ciphertext block
+    of its record in one more call. CBC encryption chains, so it needs one call per record,
+    on a CBC object of the task's own: it chains on the last block of the previous record,
+    so each first block is XOR-ed with that block and the record's IV first, and no lock
+    is shared with other tasks.
+
+    Inputs
+
+        key - bytestring - Key shared by the records
+        items - list(tuple(bytestring, bytestring)) - (iv, data) of each record, data padded to whole blocks
+        mode - string - "ECB" or "CBC"
+        decrypt - bool - Decrypt, else encrypt
+        b_len - int - Block length - default=16
+        out - memoryview - Writable buffer for the outputs back to back, None to return them - default=None
+
+    Outputs
+
+        res - bytestring - Outputs back to back, only if out is None
+    '''
+
+    total = sum([len(data) for iv, data in items])
+    ret = out is None
+    if ret:
+        out = bytearray(total)
+    out = memoryview(out)[:total]
+
+    if total == 0:
+        pass
+    elif mode == "ECB" or decrypt:
+        ciph_obj = aes_ecb_context(bytes(key))
+        data = b''.join([data for iv, data in items])
+        if decrypt:
+            ciph_obj.decrypt(data, output=out)
+        else:
+            ciph_obj.encrypt(data, output=out)
+        if mode == "CBC":
+            xor_into(out, out, b''.join([iv + data[:-b_len] for iv, data in items if data]))
+    else:
+        ciph_obj = AES.new(bytes(key), AES.MODE_CBC, iv=bytes(b_len))
+        chain = 0 # last ciphertext block of the previous record, which ciph_obj chains on
+        pos = 0
+        for iv, data in items:
+            if not data:
+                continue
+            first = int.from_bytes(data[:b_len], 'big') ^ int.from_bytes(iv, 'big') ^ chain
+            ciph = ciph_obj.encrypt(first.to_bytes(b_len, 'big') + data[b_len:])
+            out[pos:pos+len(data)] = ciph # faster than output= for records of a few blocks
+            chain = int.from_bytes(ciph[-b_len:], 'big')
+            pos += len(data)
+
+    if ret:
+        return bytes(out)
+
+def aes_batch(records, mode="CBC", decrypt=False, workers=None, processes=False, task_size=1 << 20, b_len=16):
+    '''
+    Encrypts or decrypts many (key, iv, data) records at once. Records are grouped by key so
+    each key schedule is expanded once, and the outputs of a group are laid out back to back in
+    one preallocated buffer. Groups are split into tasks of about task_size bytes and run on a
+    thread pool, which runs in parallel as the native AES code releases the GIL, or on a
+    process pool, whose results are copied into the buffer.
+    Each output equals cbc_encrypt / cbc_decrypt of its record, or aes_ecb_encrypt /
+    aes_ecb_decrypt of it padded with cbc_pad.
+
+    Inputs
+
+        records - list(tuple(bytestring, bytestring, bytestring)) - (key, iv, data), iv is ignored for ECB
+        mode - string - "ECB" or "CBC" - default="CBC"
+        decrypt - bool - Decrypt, else encrypt - default=False
+        workers - int - Number of threads or processes - default=os.cpu_count()
+        processes - bool - Use a process pool instead of threads - default=False
+        task_size - int - Bytes of records handed to a worker at a time - default=1MB
+        b_len - int - Block length - default=16
+
+    Outputs
+
+        out - bytearray - Outputs of all records
+        offsets - list(tuple(int, int)) - (start, end) of the output of each record in out, in order
+    '''
+
+    if mode not in ("ECB", "CBC"):
+        raise ValueError("Unsupported mode: {}".format(mode))
+
+    groups = {}
+    for j, (key, iv, data) in enumerate(records):
+        groups.setdefault(bytes(key), []).append(j)
+
+    offsets = [None] * len(records)
+    tasks = [] # (key, items, start, size)
+    pos = 0
+    for key, entries in groups.items():
+        items, start = [], pos
+        for j in entries:
+            data = cbc_pad(bytes(records[j][2]), b_len)
+            if items and pos - start + len(data) > task_size:
+                tasks.append((key, items, start, pos - start))
+                items, start = [], pos
+            items.append((records[j][1], data))
+            offsets[j] = (pos, pos + len(data))
+            pos += len(data)
+        if items:
+            tasks.append((key, items, start, pos - start))
+
+    out = bytearray(pos)
+    workers = workers or os.cpu_count() or 1
+    if processes:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(aes_batch_task, *zip(*[(key, items, mode, decrypt, b_len) for key, items, start, size in tasks]))
+            for (key, items, start, size), res in zip(tasks, results):
+                out[start:start+size] = res
+    else:
+        b_out = memoryview(out)
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda task: aes_batch_task(task[0], task[1], mode, decrypt, b_len,
+                                                      b_out[task[2]:task[2]+task[3]]), tasks))
+        b_out.release()
+
+    return out, offsets
+
+def aes_stream_blocks(chunks, ciph_func, b_len=16):
+    '''
+    Applies a block cipher function to a stream of chunks, whole blocks at a time. Bytes that
+    do not complete a block are carried to the next chunk, and a final partial block is padded
+    with cbc_pad.
+
+    Inputs
 
+        chunks - iterable(bytestring) - Input chunks of any length
+        ciph_func - func pointer - encrypt or decrypt method of a cipher object
+        b_len - int - Block length - default=16
+
+    Outputs
+
+        data - bytestring - Next processed chunk, a multiple of b_len long
+    '''
+
+    rest = b''
+    for chunk in chunks:
+        data = rest + chunk if rest else chunk
+        cut = len(data) - len(data) % b_len
+        rest = data[cut:]
+        if cut:
+            yield ciph_func(memoryview(data)[:cut])
+    if rest:
+        yield ciph_func(cbc_pad(rest, b_len))
+
+def aes_stream_context(key, mode, iv):
+    '''
+    Returns the cipher object used by the streaming API. A CBC object carries its chaining
+    state from one call to the next, so chunks can be processed one after another.
+
+    Inputs
+
+        key - bytestring - Key
+        mode - string - "ECB" or "CBC"
+        iv - bytestring - Initialization Vector, ignored for ECB
+
+    Outputs
+
+        ciph_obj - Crypto.Cipher AES object - Cipher for key and mode
+    '''
+
+    if mode == "ECB":
+        return aes_ecb_context(bytes(key))
+    if mode == "CBC":
+        return AES.new(key, AES.MODE_CBC, iv=iv)
+    raise ValueError("Unsupported mode: {}".format(mode))
+
+def aes_stream_encrypt(src, dst, key, mode="CBC", iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", b64=False, chunk_size=1 << 16):
+    '''
+    Encrypts plaintext read from a file object or mmap with AES-ECB or AES-CBC and writes the
+    ciphertext to dst as it goes. Memory stays bounded by chunk_size whatever the input size.
+    Output is identical to aes_ecb_encrypt(cbc_pad(msg)) or cbc_encrypt(msg) on the whole input.
+
+    Inputs
+
+        src - file object/mmap - Binary plaintext source
+        dst - file object - Binary ciphertext sink
+        key - bytestring - Key
+        mode - string - "ECB" or "CBC" - default="CBC"
+        iv - bytestring - Initialization Vector for first block - default=b'\x00'*16
+        b64 - bool - Base64-encode the ciphertext - default=False
+        chunk_size - int - Bytes read from src at a time - default=65536
+
+    Outputs
+
+        written - int - Number of bytes written to dst
+    '''
+
+    ciph_obj = aes_stream_context(key, mode, iv)
+    out_chunks = aes_stream_blocks(read_chunks(src, chunk_size), ciph_obj.encrypt)
+    if b64:
+        out_chunks = b64_encode_chunks(out_chunks)
+
+    written = 0
+    for data in out_chunks:
+        dst.write(data)
+        written += len(data)
+    return written
+
+def aes_stream_decrypt(src, dst, key, mode="CBC", iv=b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", b64=False, chunk_size=1 << 16):
+    '''
+    Decrypts AES-ECB or AES-CBC ciphertext read from a file object or mmap and writes the
+    plaintext to dst as it goes. Memory stays bounded by chunk_size whatever the input size.
+    Output is identical to aes_ecb_decrypt or cbc_decrypt on the whole input.
+
+    Inputs
+
+        src - file object/mmap - Ciphertext source, text or binary if b64 is set, else binary
+        dst - file object - Binary plaintext sink
+        key - bytestring - Key
+        mode - string - "ECB" or "CBC" - default="CBC"
+        iv - bytestring - Initialization Vector for first block - default=b'\x00'*16
+        b64 - bool - Ciphertext is base64 encoded - default=False
+        chunk_size - int - Bytes read from src at a time - default=65536
+
+    Outputs
+
+        written - int - Number of bytes written to dst
+    '''
+
+    ciph_obj = aes_stream_context(key, mode, iv)
+    in_chunks = read_chunks(src, chunk_size)
+    if b64:
+        in_chunks = b64_decode_chunks(in_chunks)
+
+    written = 0
+    for data in aes_stream_blocks(in_chunks, ciph_obj.decrypt):
+        dst.write(data)
+        written += len(data)
+    return written
+
+def main():
     key = "YELLOW SUBMARINE"
     b_key = bytes(key, 'utf-8')
-    print(cbc_decrypt(ciph, b_key).decode())
+
+    with mapped("p10_in.txt") as mm:
+        aes_stream_decrypt(mm, sys.stdout.buffer, b_key, "CBC", b64=True)
+    print()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
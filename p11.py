@@ -3,6 +3,7 @@
 import secrets
 from p09 import pkcs7pad
 from p10 import aes_ecb_encrypt, cbc_encrypt
+from oracle_stats import mark_phase
 
 def ecb_cbc_encrypt_oracle(msg):
     '''
@@ -35,6 +36,36 @@ def ecb_cbc_encrypt_oracle(msg):
 
     return ciph
 
+# Since only 5-10 bytes are prepended, 2nd and 3rd blocks of this input are always As
+detect_probe = bytes("AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA", 'utf-8')  # length 48
+
+def ecb_cbc_detect_ciph(ciph, blk_size=16):
+    '''
+    Detects the mode of encryption from the oracle output for detect_probe
+
+    Inputs
+
+        ciph - bytestring - Oracle output for detect_probe
+        blk_size - int - Block size - default=16
+
+    Outputs
+
+        mode - int - Mode of encryption (ECB=0, CBC=1)
+    '''
+
+    ## For ECB, 2nd and 3rd block of output will be identical.
+    ## For CBC, 2nd and 3rd block of output will NOT be identical  
+    
+    blk2 = ciph[blk_size:2*blk_size]
+    blk3 = ciph[2*blk_size:3*blk_size]
+
+    if blk2 == blk3:
+        mode = 0
+    else:
+        mode = 1
+    
+    return mode
+
 def ecb_cbc_detect_oracle(enc_oracle):
     '''
     Calls the random ECB/CBC encryption oracle and detects which mode was used
@@ -55,26 +86,29 @@ def ecb_cbc_detect_oracle(enc_oracle):
     ## so as to have at least 2 identical plaintext blocks. 
     ## If ECB is used, we get 2 identical ciphertext blocks.
     ## If CBC is used, we most likely will not get identical 
-    mode = -1
-    blk_size = 16
-
-    msg = "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"  # length 48
-    b_msg = bytes(msg, 'utf-8')
-    ciph = enc_oracle(b_msg)
 
-    ## Since only 5-10 bytes are prepended, 2nd and 3rd blocks of input are 
-    ## guaranteed to be As. 
-    ## For ECB, 2nd and 3rd block of output will be identical.
-    ## For CBC, 2nd and 3rd block of output will NOT be identical  
+    mark_phase('mode_detection')
+    ciph = enc_oracle(detect_probe)
+    mode = ecb_cbc_detect_ciph(ciph)
     
-    blk2 = ciph[blk_size:2*blk_size]
-    blk3 = ciph[2*blk_size:3*blk_size]
+    return mode
+
+async def async_ecb_cbc_detect_oracle(enc_oracle):
+    '''
+    Same as ecb_cbc_detect_oracle, for an asyncio oracle (see oracle_net.connect_oracle)
+
+    Inputs
+
+        enc_oracle - async func pointer - Encryption Oracle
+
+    Outputs
+
+        mode - int - Mode of encryption (ECB=0, CBC=1)
+    '''
+
+    ciph = await enc_oracle(detect_probe)
+    mode = ecb_cbc_detect_ciph(ciph)
 
-    if blk2 == blk3:
-        mode = 0
-    else:
-        mode = 1
-    
     return mode
 
 def main():
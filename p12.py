@@ -1,13 +1,53 @@
 ## S2C12 - Byte-at-a-time ECB decryption
 
+import asyncio
 import base64
 import secrets
-from p09 import pkcs7pad
-from p10 import aes_ecb_encrypt, cbc_encrypt
-from p11 import ecb_cbc_detect_oracle
+from collections import OrderedDict
+from functools import lru_cache
+from p07 import aes_ecb_context
+from p09 import pkcs7_pads
+from oracle_stats import mark_phase, instrument_oracle, new_stats
 
 key = secrets.token_bytes(16)
 
+# Constant unknown suffix, decoded once instead of on every oracle call
+suffix = base64.b64decode("Um9sbGluJyBpbiBteSA1LjAKV2l0aCBteSByYWctdG9wIGRvd24gc28gbXkg \
+                          aGFpciBjYW4gYmxvdwpUaGUgZ2lybGllcyBvbiBzdGFuZGJ5IHdhdmluZyBq \
+                          dXN0IHRvIHNheSBoaQpEaWQgeW91IHN0b3A/IE5vLCBJIGp1c3QgZHJvdmUg \
+                          YnkK")
+
+@lru_cache(maxsize=64)
+def make_ecb_encrypt_oracle(key, suf=suffix, b_len=16):
+    '''
+    Builds an ECB encryption oracle that appends suf to its input, pads it with PKCS#7 and
+    encrypts it under key. The oracle holds one expanded AES key and the pad for every length,
+    so a call only concatenates and encrypts. Oracles are cached per key, LRU bounded.
+
+    Inputs
+
+        key - bytestring - Key
+        suf - bytestring - Constant suffix - default=suffix
+        b_len - int - Block length - default=16
+
+    Outputs
+
+        ecb_oracle(bytestring msg) - func pointer - ECB encryption oracle
+    '''
+
+    ciph_obj = aes_ecb_context(key)
+    suf_len = len(suf)
+    pad_tails = pkcs7_pads
+
+    def ecb_oracle(msg):
+        return ciph_obj.encrypt(msg + suf + pad_tails[b_len - (len(msg) + suf_len) % b_len])
+
+    def ecb_oracle_batch(msgs):
+        return [ciph_obj.encrypt(msg + suf + pad_tails[b_len - (len(msg) + suf_len) % b_len]) for msg in msgs]
+
+    ecb_oracle.batch = ecb_oracle_batch
+    return ecb_oracle
+
 def ecb_encrypt_oracle(msg):
     '''
     Randomly encrypts plaintext in AES-ECB or AES-CBC with equal chance
@@ -23,30 +63,65 @@ def ecb_encrypt_oracle(msg):
     '''
 
     global key
-    
-    b_suf = base64.b64decode("Um9sbGluJyBpbiBteSA1LjAKV2l0aCBteSByYWctdG9wIGRvd24gc28gbXkg \
-                            aGFpciBjYW4gYmxvdwpUaGUgZ2lybGllcyBvbiBzdGFuZGJ5IHdhdmluZyBq \
-                            dXN0IHRvIHNheSBoaQpEaWQgeW91IHN0b3A/IE5vLCBJIGp1c3QgZHJvdmUg \
-                            YnkK")
 
-    new_msg = msg + b_suf
-    new_msg = pkcs7pad(new_msg, 16)
-
-    ciph = aes_ecb_encrypt(new_msg, key)
+    ciph = make_ecb_encrypt_oracle(key)(msg)
 
     return ciph
 
-def gen_ecb_dict(ecb_enc_oracle, payload, blk_size):
+def ecb_encrypt_oracle_batch(msgs):
+    '''
+    Batch form of ecb_encrypt_oracle - encrypts every message of msgs in one query
+
+    Inputs
+
+        msgs - list(bytestring) - Plaintexts
+
+    Outputs
+
+        ciphs - list(bytestring) - Encrypted ciphertexts, in order
+    '''
+
+    global key
+
+    return make_ecb_encrypt_oracle(key).batch(msgs)
+
+ecb_encrypt_oracle.batch = ecb_encrypt_oracle_batch
+
+def query_batch(enc_oracle, msgs):
+    '''
+    Sends a batch of inputs to an oracle in one round trip if the oracle offers a batch
+    form as enc_oracle.batch, else falls back to one call per input
+
+    Inputs
+
+        enc_oracle - func pointer - Encryption oracle, optionally with a batch attribute
+        msgs - list(bytestring) - Plaintexts
+
+    Outputs
+
+        ciphs - list(bytestring) - Encrypted ciphertexts, in order
+    '''
+
+    batch = getattr(enc_oracle, 'batch', None)
+    if batch is not None:
+        return batch(msgs)
+    return [enc_oracle(msg) for msg in msgs]
+
+single_bytes = [bytes([byte]) for byte in range(256)] # every possible last byte of a probe
+
+def gen_ecb_dict(ecb_enc_oracle, payload, blk_size, fill=b'', skip=0):
     '''
     Generates dictionary of ECB inputs and outputs of an ECB oracle using constant unknown key.
     Uses blk_size-1 known characters and generates inputs and outputs for all values of
-    last byte.
+    last byte. All probes are sent as one batch with query_batch.
 
     Inputs
 
         ecb_enc_oracle - func pointer - ECB encryption oracle
         payload - bytestring - blk_size-1 known characters
         blk_size - int - ECB block size
+        fill - bytestring - Sent before every input to complete the oracle's prefix block - default=b''
+        skip - int - Number of ciphertext blocks covering the prefix and fill - default=0
 
     Outputs
 
@@ -54,24 +129,271 @@ def gen_ecb_dict(ecb_enc_oracle, payload, blk_size):
         
     '''
     
-    ecb_dict = dict()
     payload = payload[:blk_size-1]
+    probes = [payload + b_hex_byte for b_hex_byte in single_bytes]
 
-    for byte in range(256):
-        b_hex_byte = bytes([byte])
+    ciphs = query_batch(ecb_enc_oracle, [fill + probe for probe in probes])
+    start = skip*blk_size
+    ecb_dict = {ciph[start:start+blk_size]: probe for ciph, probe in zip(ciphs, probes)}
 
-        ecb_dict[ecb_enc_oracle(payload+b_hex_byte)[:blk_size]] = payload+b_hex_byte
-    
     return ecb_dict    
 
-def ecb_decrypt_oracle(ecb_enc_oracle):
+def gen_ecb_dict_target(ecb_enc_oracle, payload, blk_size, target, fill=b'', skip=0):
+    '''
+    Same as gen_ecb_dict, with target sent in the same batch as the probes
+
+    Inputs
+
+        ecb_enc_oracle - func pointer - ECB encryption oracle
+        payload - bytestring - blk_size-1 known characters
+        blk_size - int - ECB block size
+        target - bytestring - Extra input sent after the probes
+        fill - bytestring - Sent before every input to complete the oracle's prefix block - default=b''
+        skip - int - Number of ciphertext blocks covering the prefix and fill - default=0
+
+    Outputs
+
+        ecb_dict - dict - Dictionary of 255 entries with all possible combinations of last byte
+        target_ciph - bytestring - Oracle output for target after the skipped blocks
+    '''
+
+    payload = payload[:blk_size-1]
+    probes = [payload + b_hex_byte for b_hex_byte in single_bytes]
+
+    ciphs = query_batch(ecb_enc_oracle, [fill + probe for probe in probes] + [fill + target])
+    start = skip*blk_size
+    ecb_dict = {ciph[start:start+blk_size]: probe for ciph, probe in zip(ciphs[:256], probes)}
+
+    return ecb_dict, ciphs[256][start:]
+
+all_bytes = bytes(range(256))
+
+def ecb_probe_query(payload, blk_size):
+    '''
+    Builds one query holding the 256 one-block probes payload + byte, for every byte value.
+    ECB encrypts blocks independently, so probe i comes back as ciphertext block i.
+
+    Inputs
+
+        payload - bytestring - blk_size-1 known characters
+        blk_size - int - ECB block size
+
+    Outputs
+
+        query - bytearray - 256 probe blocks, ready to have more input appended
+    '''
+
+    query = bytearray((payload[:blk_size-1] + b'\x00') * 256)
+    query[blk_size-1::blk_size] = all_bytes # last byte of each block
+    return query
+
+probe_table_cache = OrderedDict() # (oracle, fingerprint, payload) -> {ciphertext block: last probe byte}
+probe_table_cache_size = 512      # tables kept, about 20KB each
+
+def ecb_probe_table(ecb_enc_oracle, payload, blk_size, target=None, concat=True, fill=b'', skip=0,
+                    fingerprint=None):
+    '''
+    Returns the probe table of payload, mapping the ciphertext block of payload + byte to byte,
+    together with the oracle output for target if one is given. Given a fingerprint, tables are
+    kept in an LRU cache keyed by oracle (an instrumented oracle counts as the one it wraps),
+    fingerprint and payload, so a repeated payload or a restarted run costs no query, or one
+    for target. The table depends on the key behind the oracle, which the oracle object does
+    not identify, so the fingerprint has to: any ciphertext block of a fixed input will do.
+    On a miss the probes and target go out in one round trip.
+
+    Inputs
+
+        ecb_enc_oracle - func pointer - ECB encryption oracle
+        payload - bytestring - blk_size-1 known characters
+        blk_size - int - ECB block size
+        target - bytestring - Input whose oracle output is also returned - default=None
+        concat - bool - Send probes and target as one concatenated query, else
+                        as one batch through gen_ecb_dict(_target) - default=True
+        fill - bytestring - Sent first to complete the oracle's prefix block - default=b''
+        skip - int - Number of ciphertext blocks covering the prefix and fill - default=0
+        fingerprint - bytestring - Oracle output identifying its key, no caching if None - default=None
+
+    Outputs
+
+        table - dict - Ciphertext block to last probe byte, for all 256 probes
+        target_ciph - bytestring - Oracle output for target, after the skipped blocks, None without target
+    '''
+
+    start = skip*blk_size
+    cache_key = (getattr(ecb_enc_oracle, '__wrapped__', ecb_enc_oracle), fingerprint, payload)
+    table = probe_table_cache.get(cache_key) if fingerprint is not None else None
+    if table is not None:
+        probe_table_cache.move_to_end(cache_key)
+        return table, None if target is None else ecb_enc_oracle(fill + target)[start:]
+
+    target_ciph = None
+    if concat:
+        query = bytearray(fill)
+        query += ecb_probe_query(payload, blk_size)
+        if target is not None:
+            query += target
+        ciph = ecb_enc_oracle(query)
+        table = {ciph[start+i*blk_size:start+(i+1)*blk_size]: i for i in range(256)}
+        if target is not None:
+            target_ciph = ciph[start+256*blk_size:]
+    elif target is not None:
+        ecb_dict, target_ciph = gen_ecb_dict_target(ecb_enc_oracle, payload, blk_size, target, fill, skip)
+        table = {blk: probe[-1] for blk, probe in ecb_dict.items()}
+    else:
+        ecb_dict = gen_ecb_dict(ecb_enc_oracle, payload, blk_size, fill, skip)
+        table = {blk: probe[-1] for blk, probe in ecb_dict.items()}
+
+    if fingerprint is not None:
+        probe_table_cache[cache_key] = table
+        if len(probe_table_cache) > probe_table_cache_size:
+            probe_table_cache.popitem(last=False)
+
+    return table, target_ciph
+
+def first_diff_block(ciph1, ciph2, blk_size):
+    '''
+    Returns the index of the first block where two ciphertexts differ
+    '''
+
+    for blk in range(min(len(ciph1), len(ciph2)) // blk_size):
+        if ciph1[blk*blk_size:(blk+1)*blk_size] != ciph2[blk*blk_size:(blk+1)*blk_size]:
+            return blk
+    return min(len(ciph1), len(ciph2)) // blk_size
+
+profile_cache = OrderedDict() # (oracle, max_len) -> profile
+profile_cache_size = 64
+
+def cache_profile(cache_key, profile):
+    '''
+    Stores a profile in profile_cache, evicting the least recently used one once full
+    '''
+
+    profile_cache[cache_key] = profile
+    profile_cache.move_to_end(cache_key)
+    if len(profile_cache) > profile_cache_size:
+        profile_cache.popitem(last=False)
+
+def profile_ciph_len(profile, msg_len):
+    '''
+    Returns the ciphertext length a profiled oracle gives for an input of msg_len bytes,
+    used to check that a cached profile still holds
+    '''
+
+    blk_size = profile['blk_size']
+    return (profile['prefix_len'] + msg_len + profile['suffix_len']) // blk_size * blk_size + blk_size
+
+def profile_alignment(profile):
+    '''
+    Returns the fill bytes completing the prefix's last block, and the number of ciphertext
+    blocks covering prefix and fill, which attacks skip
+    '''
+
+    blk_size = profile['blk_size']
+    fill = b"F" * ((blk_size - profile['prefix_len'] % blk_size) % blk_size)
+    return fill, (profile['prefix_len'] + len(fill)) // blk_size
+
+def profile_ecb_oracle(ecb_enc_oracle, max_len=64, refresh=False):
+    '''
+    Finds the block size, the mode and the lengths of the constant prefix and suffix an encryption
+    oracle wraps around its input, with as few queries as possible. The result is kept in an
+    LRU cache keyed like the probe tables (an instrumented oracle counts as the one it wraps),
+    so repeated attack runs skip discovery. On a miss the queries go through ecb_enc_oracle
+    itself, so an instrumented oracle records them. Attacks check a cached profile against
+    their first query (see profile_ciph_len) and ask again with refresh if it no longer holds.
+
+    Block size - the ciphertext length only grows once the input fills the last padded block,
+                 so a binary search over input lengths finds the first growth, and its size.
+    Prefix     - inputs "A" and "B" first differ at byte prefix_len, which gives its block.
+                 Its offset in the block is found by a binary search over the number of "A"s
+                 needed to push that difference into the next block.
+    Mode       - one crafted query that completes the prefix block and then sends 2 blocks of
+                 "A"; under ECB those 2 blocks encrypt to the same ciphertext block.
+
+    Inputs
+
+        ecb_enc_oracle(bytestring msg) - func pointer - Encryption oracle with a fixed length prefix
+        max_len - int - Longest input tried when discovering the block size - default=64
+        refresh - bool - Profile again, replacing any cached profile - default=False
+
+    Outputs
+
+        profile - dict(blk_size, mode, prefix_len, suffix_len, queries) - Oracle profile, mode is ECB=0, CBC=1,
+                                                                          queries is the number it took
+    '''
+
+    cache_key = (getattr(ecb_enc_oracle, '__wrapped__', ecb_enc_oracle), max_len)
+    profile = None if refresh else profile_cache.get(cache_key)
+    if profile is not None:
+        profile_cache.move_to_end(cache_key)
+        return profile
+
+    queries = [0]
+    def query(msg):
+        queries[0] += 1
+        return ecb_enc_oracle(msg)
+
+    # ---Block size--- smallest input length n at which the ciphertext grows
+    mark_phase('block_size')
+    base_len = len(query(b''))
+    lo, hi = 1, max_len
+    if len(query(b"A" * hi)) == base_len:
+        raise ValueError("Block size not found for inputs up to {} bytes".format(max_len))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if len(query(b"A" * mid)) > base_len:
+            hi = mid
+        else:
+            lo = mid + 1
+    blk_size = len(query(b"A" * lo)) - base_len
+    fixed_len = base_len - lo # prefix_len + suffix_len
+
+    # ---Prefix length--- block of the first input byte, then its offset in that block
+    mark_phase('prefix')
+    prefix_blk = first_diff_block(query(b"A"), query(b"B"), blk_size)
+    lo, hi = 1, blk_size # smallest number of "A"s pushing the first input byte into the next block
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if first_diff_block(query(b"A" * mid + b"A"), query(b"A" * mid + b"B"), blk_size) > prefix_blk:
+            hi = mid
+        else:
+            lo = mid + 1
+    prefix_len = prefix_blk*blk_size + (blk_size - lo) % blk_size
+
+    # ---Mode--- two aligned blocks of "A"
+    mark_phase('mode_detection')
+    fill_len = (blk_size - prefix_len % blk_size) % blk_size
+    ciph = query(b"A" * (fill_len + 2*blk_size))
+    start = prefix_len + fill_len
+    mode = 0 if ciph[start:start+blk_size] == ciph[start+blk_size:start+2*blk_size] else 1
+
+    profile = {'blk_size': blk_size, 'mode': mode, 'prefix_len': prefix_len,
+               'suffix_len': fixed_len - prefix_len, 'queries': queries[0]}
+    cache_profile(cache_key, profile)
+
+    return profile
+
+def ecb_decrypt_oracle(ecb_enc_oracle, concat=True, stats=None):
     '''
     Makes repeated calls to the ECB encryption oracle (having constant but randomly chosen key)
     and decrypts the constant string being appended to a message supplied to this oracle.
+    Each recovered byte costs one oracle round trip, either one concatenated query or one batch.
+    The ciphertext of each of the blk_size alignments is fetched once, the first one up front
+    and the others riding along with the first probes that need them, so recovering n bytes
+    takes n + 1 concatenated queries, or 256*n + blk_size messages in n + 1 round trips,
+    after profiling.
 
     Inputs
 
         ecb_enc_oracle(string msg) - func pointer - ECB encryption oracle
+        concat - bool - Pack the probes into one concatenated query, else send them
+                        as one batch through query_batch - default=True
+        stats - dict - Filled with the oracle calls this run made, see oracle_stats.new_stats.
+                       stats['profile_queries'] is set to the number of them spent on
+                       profiling, 0 when the profile was cached - default=None
+
+        Probe tables are cached across runs, fingerprinted by the first block of the first
+        alignment's ciphertext, so a new key behind the same oracle gets new tables. See
+        ecb_probe_table.
 
     Outputs
 
@@ -80,42 +402,22 @@ def ecb_decrypt_oracle(ecb_enc_oracle):
     '''
 
     '''
-    ---Discovering Block Size---
+    ---Profiling The Oracle---
 
-    First pass 1 byte "A", then 2 bytes "AA", then "AAA" and so on.
-    For each message, the ciphertext length starts with some length
-    blk_size*blk_count.
-    At some message size M, this length suddenly changes to 
-    blk_size*(blk_count+1). Subtract the lengths to get block size 
-    '''
-    msg = "A"
-    b_msg = bytes(msg, "utf-8")
-    ciph = ecb_enc_oracle(b_msg)
-    curr_len = len(ciph)
-    num_blk = -1
-    blk_size = -1
-    while True:
-        ciph = ecb_enc_oracle(b_msg)
-        if curr_len != len(ciph):
-            blk_size = len(ciph) - curr_len
-            num_blk = (len(ciph) // blk_size) - 1
-            if len(b_msg) == blk_size:
-                num_blk -= 1
-            break
-        else:
-            b_msg += bytes("A", "utf-8")
-            
-    '''
-    ---Checking If Oracle Is ECB---
+    Block size, mode and the length of any constant prefix and of the suffix,
+    see profile_ecb_oracle. The profile is cached per oracle, like the probe tables.
+    If there is a prefix, every input starts with fill bytes completing the
+    prefix's last block, and the skip blocks covering prefix and fill are ignored.
 
-    Use the function we created in S2C11 (p11.py)
+    The secret or prefix may have changed behind the same oracle since the profile
+    was cached, so the length of the first target is checked against the profile,
+    and the oracle is profiled again if they disagree, or if a byte finds no match.
     '''
 
-    for i in range(10):
-        mode = ecb_cbc_detect_oracle(ecb_enc_oracle)
-        if mode == 1:
-            return "Cannot detect for non-ECB oracle."
-    
+    if stats is not None:
+        ecb_enc_oracle = instrument_oracle(ecb_enc_oracle, stats)
+        stats['profile_queries'] = 0
+
     '''
     ---Byte-By-Byte Character Guessing---
 
@@ -144,42 +446,183 @@ def ecb_decrypt_oracle(ecb_enc_oracle):
     Repeat this till this block is extracted.
 
     Repeat this entire thing till the string is exhausted and all blocks have
-    been recovered. We will get some padding bytes due to PKCS#7, which will
-    change when reducing the payload length.
-
-    In that event, the output block will not be found in the dictionary
-    since the pad byte value would have increased by one, e.g., 0x01 -> 0x02
-    At this point we break and return the answer.
+    been recovered. The profile gives the exact suffix length, so we stop
+    there, before reaching the PKCS#7 pad bytes.
+
+    All of this is one pass over a rolling window: with known = "A" * (blk_size-1) + suf,
+    the blk_size-1 known characters before suf[i] are always known[i:i+blk_size-1], and
+    the payload aligning suf[i] to the end of block i // blk_size is "A" * (blk_size-1 - i % blk_size).
+    There are only blk_size such payloads, and the ciphertext of one holds the target block
+    of every suf[i] with that alignment, so each is fetched once and kept in targets.
+    The first one is fetched while checking the profile, and fingerprints the key.
+    A target block no probe matches means the oracle changed since it was profiled,
+    so the attack starts over once with a new profile.
     '''
 
-    suf = b''
-    
-    for blk in range(num_blk):
-        payload = "A" * (blk_size-1)
-        b_payload = bytes(payload, 'utf-8')
-        
-        # extracting blk_size unknown chars
-        for byte in range(blk_size):
-            b_payload_w_suf = b_payload * max(1-blk,0) + suf[(blk-1)*blk_size+byte+1:blk*blk_size]*min(blk,1) + suf[(blk*blk_size):(blk*blk_size) + byte]
-            ecb_dict = gen_ecb_dict(ecb_enc_oracle, b_payload_w_suf, blk_size)
-            imp_blk = ecb_enc_oracle(b_payload)[blk*blk_size:(blk+1)*(blk_size)]
-
-            try:
-                new_char = ecb_dict[imp_blk][-1]
-            except KeyError: # when pad bytes are encountered
+    for refresh in (False, True):
+        calls_before = stats['calls'] if stats is not None else 0
+        profile = profile_ecb_oracle(ecb_enc_oracle, refresh=refresh)
+        if stats is not None:
+            stats['profile_queries'] += stats['calls'] - calls_before
+        if profile['mode'] == 1:
+            return "Cannot detect for non-ECB oracle."
+
+        blk_size = profile['blk_size']
+        fill, skip = profile_alignment(profile)
+        known = bytearray(b"A" * (blk_size-1))
+        alignments = [b"A" * (blk_size-1 - byte) for byte in range(blk_size)]
+        targets = [None] * blk_size # oracle output for each alignment, after the skipped blocks
+
+        mark_phase('dictionary')
+        first_ciph = ecb_enc_oracle(fill + alignments[0])
+        if len(first_ciph) != profile_ciph_len(profile, len(fill) + blk_size-1):
+            continue
+        targets[0] = first_ciph[skip*blk_size:]
+        fingerprint = targets[0][:blk_size]
+
+        for i in range(profile['suffix_len']):
+            blk = i // blk_size
+            align = i % blk_size
+            mark_phase('dictionary')
+            table, target_ciph = ecb_probe_table(ecb_enc_oracle, bytes(known[i:i+blk_size-1]), blk_size,
+                                                 alignments[align] if targets[align] is None else None,
+                                                 concat, fill, skip, fingerprint)
+            if target_ciph is not None:
+                targets[align] = target_ciph
+            mark_phase('matching')
+            new_char = table.get(targets[align][blk*blk_size:(blk+1)*blk_size])
+            if new_char is None: # the oracle changed since it was profiled
                 break
+            known.append(new_char)
+        else:
+            suf = bytes(known[blk_size-1:])
+            return suf
+
+    raise ValueError("Oracle does not match its profile, even after profiling it again")
+
+async def async_profile_ecb_oracle(ecb_enc_oracle, max_len=64, refresh=False):
+    '''
+    Same profile as profile_ecb_oracle, for an asyncio oracle, sharing profile_cache. The
+    binary searches become one round of concurrent queries each: every input length up to
+    max_len for the block size, and every "A"*m + "A" / "A"*m + "B" pair for the prefix.
+
+    Inputs
 
-            suf += bytes([new_char])
-            b_payload = b_payload[:len(b_payload)-1]
+        ecb_enc_oracle(bytestring msg) - async func pointer - Encryption oracle with a fixed length prefix
+        max_len - int - Longest input tried when discovering the block size - default=64
+        refresh - bool - Profile again, replacing any cached profile - default=False
+
+    Outputs
+
+        profile - dict(blk_size, mode, prefix_len, suffix_len, queries) - Oracle profile, see profile_ecb_oracle
+    '''
+
+    cache_key = (getattr(ecb_enc_oracle, '__wrapped__', ecb_enc_oracle), max_len)
+    profile = None if refresh else profile_cache.get(cache_key)
+    if profile is not None:
+        profile_cache.move_to_end(cache_key)
+        return profile
+
+    # ---Block size--- all input lengths at once, then the first one the ciphertext grows at
+    mark_phase('block_size')
+    ciphs = await asyncio.gather(*[ecb_enc_oracle(b"A" * n) for n in range(max_len + 1)])
+    base_len = len(ciphs[0])
+    grown = next((n for n in range(1, max_len + 1) if len(ciphs[n]) > base_len), None)
+    if grown is None:
+        raise ValueError("Block size not found for inputs up to {} bytes".format(max_len))
+    blk_size = len(ciphs[grown]) - base_len
+    fixed_len = base_len - grown # prefix_len + suffix_len
+    queries = max_len + 1
+
+    # ---Prefix length--- all numbers of "A"s at once, then the first that pushes the difference on
+    mark_phase('prefix')
+    pairs = await asyncio.gather(*[ecb_enc_oracle(b"A" * m + last) for m in range(blk_size) for last in (b"A", b"B")])
+    diff_blks = [first_diff_block(pairs[2*m], pairs[2*m + 1], blk_size) for m in range(blk_size)]
+    pushed = next((m for m in range(1, blk_size) if diff_blks[m] > diff_blks[0]), blk_size)
+    prefix_len = diff_blks[0]*blk_size + (blk_size - pushed) % blk_size
+    queries += 2*blk_size
+
+    # ---Mode--- two aligned blocks of "A"
+    mark_phase('mode_detection')
+    fill_len = (blk_size - prefix_len % blk_size) % blk_size
+    ciph = await ecb_enc_oracle(b"A" * (fill_len + 2*blk_size))
+    start = prefix_len + fill_len
+    mode = 0 if ciph[start:start+blk_size] == ciph[start+blk_size:start+2*blk_size] else 1
+
+    profile = {'blk_size': blk_size, 'mode': mode, 'prefix_len': prefix_len,
+               'suffix_len': fixed_len - prefix_len, 'queries': queries + 1}
+    cache_profile(cache_key, profile)
+
+    return profile
+
+async def async_ecb_decrypt_oracle(ecb_enc_oracle, max_len=64, concat=True):
+    '''
+    Same attack as ecb_decrypt_oracle, for an asyncio oracle (see oracle_net.connect_oracle).
+    Queries that do not depend on each other are issued concurrently, so a pipelined oracle
+    sees one round trip per step instead of one per query: each profiling step (see
+    async_profile_ecb_oracle), the blk_size alignment targets, and the probes of each byte.
+    The profile is checked and redone the same way as in ecb_decrypt_oracle. Probe tables
+    are not cached, an asyncio oracle is usually a new connection every run.
+
+    Inputs
+
+        ecb_enc_oracle(bytestring msg) - async func pointer - ECB encryption oracle
+        max_len - int - Longest input tried when discovering the block size - default=64
+        concat - bool - Pack the probes of each byte into one concatenated query, else send
+                        them as 256 concurrent queries - default=True
+
+    Outputs
+
+        ans - bytestring - constant pre-encryption suffix used by the encryption oracle
+    '''
+
+    for refresh in (False, True):
+        profile = await async_profile_ecb_oracle(ecb_enc_oracle, max_len, refresh)
+        if profile['mode'] == 1:
+            return "Cannot detect for non-ECB oracle."
+
+        # ---Alignment targets--- all at once, the first one checks the profile
+        blk_size = profile['blk_size']
+        fill, skip = profile_alignment(profile)
+        start = skip*blk_size
+        mark_phase('dictionary')
+        alignments = [fill + b"A" * (blk_size-1 - byte) for byte in range(blk_size)]
+        targets = await asyncio.gather(*[ecb_enc_oracle(msg) for msg in alignments])
+        if len(targets[0]) != profile_ciph_len(profile, len(alignments[0])):
+            continue
+
+        # ---Byte-By-Byte Character Guessing--- same rolling window as ecb_decrypt_oracle
+        known = bytearray(b"A" * (blk_size-1))
+        for i in range(profile['suffix_len']):
+            blk = start // blk_size + i // blk_size
+            payload = bytes(known[i:i+blk_size-1])
+            mark_phase('dictionary')
+            if concat:
+                ciph = await ecb_enc_oracle(fill + ecb_probe_query(payload, blk_size))
+                table = {ciph[start+j*blk_size:start+(j+1)*blk_size]: j for j in range(256)}
+            else:
+                ciphs = await asyncio.gather(*[ecb_enc_oracle(fill + payload + b_hex_byte) for b_hex_byte in single_bytes])
+                table = {ciph[start:start+blk_size]: byte for byte, ciph in enumerate(ciphs)}
+            mark_phase('matching')
+            new_char = table.get(targets[i % blk_size][blk*blk_size:(blk+1)*blk_size])
+            if new_char is None: # the oracle changed since it was profiled
+                break
+            known.append(new_char)
+        else:
+            suf = bytes(known[blk_size-1:])
+            return suf
 
-    return suf
+    raise ValueError("Oracle does not match its profile, even after profiling it again")
 
 def main():
     print("Running function to extract ECB constant unknown padding ...\n")
-    b_suf = ecb_decrypt_oracle(ecb_encrypt_oracle)
+    stats = new_stats()
+    b_suf = ecb_decrypt_oracle(ecb_encrypt_oracle, stats=stats)
     suf = b_suf.decode("utf-8")
     print("---Constant suffix---\n")
     print(suf)
+    print("Oracle calls: {} for {} bytes ({} profiling)".format(stats['calls'], len(b_suf),
+                                                              stats['profile_queries']))
     print("\n---Done---")
 
 if __name__ == "__main__":
@@ -0,0 +1,281 @@
+## English scoring models compiled into lookup arrays
+##
+## A model is a dict compiled once from unigram (and optionally bigram) frequencies into a
+## 256 entry array indexed by byte and a 65536 entry array indexed by byte pair. Buffers are
+## scored with C level sums over those arrays, so there is no chr() or dict lookup per byte.
+##
+## kind='frequency'      - sum of the frequency of every byte (and pair), the classic score
+## kind='log_likelihood' - sum of log probabilities, unknown bytes get log(floor)
+## kind='chi_squared'    - minus the chi-squared distance of the case folded histogram from
+##                         the expected counts, all unknown bytes pooled into one category
+##
+## Higher is better for every kind.
+
+import math
+import sys
+from array import array
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+
+# From https://en.wikipedia.org/wiki/Letter_frequency
+character_frequencies = {
+    'a': .08167, 'b': .01492, 'c': .02782, 'd': .04253,
+    'e': .12702, 'f': .02228, 'g': .02015, 'h': .06094,
+    'i': .06094, 'j': .00153, 'k': .00772, 'l': .04025,
+    'm': .02406, 'n': .06749, 'o': .07507, 'p': .01929,
+    'q': .00095, 'r': .05987, 's': .06327, 't': .09056,
+    'u': .02758, 'v': .00978, 'w': .02360, 'x': .00150,
+    'y': .01974, 'z': .00074, ' ': .13000
+}
+
+# 50 most common letter pairs, from Norvig's "English Letter Frequency Counts: Mayzner Revisited"
+bigram_frequencies = {
+    'th': .0356, 'he': .0307, 'in': .0243, 'er': .0205, 'an': .0199, 're': .0185, 'on': .0176,
+    'at': .0149, 'en': .0145, 'nd': .0135, 'ti': .0134, 'es': .0134, 'or': .0128, 'te': .0120,
+    'of': .0117, 'ed': .0117, 'is': .0113, 'it': .0112, 'al': .0109, 'ar': .0107, 'st': .0105,
+    'to': .0104, 'nt': .0104, 'ng': .0095, 'se': .0093, 'ha': .0093, 'as': .0087, 'ou': .0087,
+    'io': .0083, 'le': .0083, 've': .0083, 'co': .0079, 'me': .0079, 'de': .0076, 'hi': .0076,
+    'ri': .0073, 'ro': .0073, 'ic': .0070, 'ne': .0069, 'ea': .0069, 'ra': .0069, 'ce': .0065,
+    'li': .0062, 'ch': .0060, 'll': .0058, 'be': .0058, 'ma': .0057, 'si': .0055, 'om': .0055,
+    'ur': .0054
+}
+
+# Pair values are read two bytes at a time through array('H'), in native byte order
+little_endian = sys.byteorder == 'little'
+
+def pair_index(first, second):
+    '''
+    Returns the index of the byte pair (first, second) in a 65536 entry bigram array
+    '''
+
+    return first | second << 8 if little_endian else first << 8 | second
+
+def fold_byte(byte):
+    '''
+    Returns the frequency table key of a byte, i.e. its lowercase character
+    '''
+
+    return bytes([byte]).lower().decode('latin-1')
+
+def compile_table(freqs, size, key_of, kind, floor):
+    '''
+    Compiles a frequency dict into a score array of size entries
+
+    Inputs
+
+        freqs - dict - Frequency of each table key
+        size - int - Entries in the array, 256 or 65536
+        key_of(int index) - func pointer - Table key of an array index
+        kind - string - Model kind, see the module comment
+        floor - float - Probability of each key missing from freqs, and least probability
+                        of the category pooling them
+
+    Outputs
+
+        scores - array('d') - Score of each index
+        categories - array('H') - Chi-squared category of each index, len(freqs) for unknown keys
+        expected - list(float) - Expected probability of each category, normalized
+    '''
+
+    keys = list(freqs)
+    other = max(1 - sum(freqs.values()), floor) # a partial table (e.g. the top bigrams) leaves the rest to other keys
+    scale = (1 - other) / sum(freqs.values())
+    position = {key: i for i, key in enumerate(keys)}
+
+    scores = array('d', bytes(8 * size))
+    categories = array('H', [len(keys)]) * size
+    for index in range(size):
+        key = key_of(index)
+        if key in position:
+            categories[index] = position[key]
+        if kind == 'frequency':
+            scores[index] = freqs.get(key, 0)
+        elif kind == 'log_likelihood':
+            scores[index] = math.log(freqs[key] * scale if key in freqs else floor)
+
+    expected = [freqs[key] * scale for key in keys] + [other]
+    return scores, categories, expected
+
+def compile_model(kind='frequency', bigrams=False, bigram_weight=1.0, floor=1e-4,
+                  unigrams=tuple(character_frequencies.items()), pairs=tuple(bigram_frequencies.items())):
+    '''
+    Compiles an English scoring model. Compiled models are cached, so asking again is free and
+    returns the same dict however the arguments are passed: callers can check for the default
+    model with "model is default_model". Without bigrams, the bigram arguments are ignored.
+
+    Inputs
+
+        kind - string - 'frequency', 'log_likelihood' or 'chi_squared' - default='frequency'
+        bigrams - bool - Add the bigram score of every adjacent byte pair - default=False
+        bigram_weight - float - Weight of the bigram score against the unigram score - default=1.0
+        floor - float - Probability of characters missing from the tables - default=1e-4
+        unigrams - tuple((string, float)) - Character frequencies - default=character_frequencies
+        pairs - tuple((string, float)) - Two character frequencies - default=bigram_frequencies
+
+    Outputs
+
+        model - dict - Compiled model, see score_buffer
+    '''
+
+    if not bigrams:
+        bigram_weight, pairs = 1.0, tuple(bigram_frequencies.items())
+    return compiled_model(kind, bool(bigrams), bigram_weight, floor, tuple(unigrams), tuple(pairs))
+
+@lru_cache(maxsize=16)
+def compiled_model(kind, bigrams, bigram_weight, floor, unigrams, pairs):
+    '''
+    Cached body of compile_model, always called with every argument positional so the cache
+    sees one key per model
+    '''
+
+    if kind not in ('frequency', 'log_likelihood', 'chi_squared'):
+        raise ValueError("Unknown scoring model kind: {}".format(kind))
+
+    model = {'kind': kind, 'bigram_weight': bigram_weight if bigrams else 0}
+    model['unigram'], model['unigram_categories'], model['unigram_expected'] = compile_table(
+        dict(unigrams), 256, fold_byte, kind, floor)
+
+    model['bigram'] = model['bigram_categories'] = model['bigram_expected'] = None
+    if bigrams:
+        pair_key = {}
+        for first in range(256):
+            for second in range(256):
+                pair_key[pair_index(first, second)] = fold_byte(first) + fold_byte(second)
+        model['bigram'], model['bigram_categories'], model['bigram_expected'] = compile_table(
+            dict(pairs), 65536, pair_key.__getitem__, kind, floor)
+
+    return model
+
+default_model = compile_model() # the character_frequencies score, same values as p03.get_english_score
+
+def pair_values(buf):
+    '''
+    Returns the bigram array index of every adjacent byte pair in buf, in no particular order.
+    The pairs starting at even and at odd offsets are each read as one array('H').
+    '''
+
+    mv = memoryview(buf)
+    mv = mv.cast('B') if mv.c_contiguous else memoryview(mv.tobytes()) # e.g. a strided column view
+    evens, odds = array('H'), array('H')
+    evens.frombytes(mv[:len(mv) & ~1])
+    odds.frombytes(mv[1:1 + ((len(mv) - 1) & ~1)] if mv else b'')
+    return chain(evens, odds)
+
+def chi_squared(counts, categories, expected, total):
+    '''
+    Returns the chi-squared distance of a histogram from the expected category probabilities
+
+    Inputs
+
+        counts - iterable((int, int)) - (value, occurrences) pairs
+        categories - array - Category of each value
+        expected - list(float) - Expected probability of each category
+        total - int - Number of values counted
+
+    Outputs
+
+        chi - float - sum((observed - expected)^2 / expected) over all categories
+    '''
+
+    observed = [0] * len(expected)
+    for value, n in counts:
+        observed[categories[value]] += n
+    return sum([(obs - p * total)**2 / (p * total) for obs, p in zip(observed, expected)])
+
+def score_buffer(model, buf):
+    '''
+    Scores how English-like a buffer is
+
+    Inputs
+
+        model - dict - Compiled model from compile_model, default_model for the p03 score
+        buf - bytes-like - Buffer to be scored
+
+    Outputs
+
+        score - float - Score of buf, higher is more English-like
+    '''
+
+    if model['kind'] == 'chi_squared':
+        if not buf:
+            return 0.0
+        score = -chi_squared(Counter(buf).items(), model['unigram_categories'],
+                             model['unigram_expected'], len(buf))
+        if model['bigram_weight'] and len(buf) > 1:
+            score -= model['bigram_weight'] * chi_squared(Counter(pair_values(buf)).items(),
+                                                          model['bigram_categories'],
+                                                          model['bigram_expected'], len(buf) - 1)
+        return score
+
+    score = sum(map(model['unigram'].__getitem__, buf))
+    if model['bigram_weight']:
+        score += model['bigram_weight'] * sum(map(model['bigram'].__getitem__, pair_values(buf)))
+    return score
+
+def score_batch(model, bufs):
+    '''
+    Scores a batch of candidate buffers with one model
+
+    Inputs
+
+        model - dict - Compiled model from compile_model
+        bufs - iterable(bytes-like) - Candidates
+
+    Outputs
+
+        scores - list(float) - Score of each candidate
+    '''
+
+    return [score_buffer(model, buf) for buf in bufs]
+
+def score_all_keys(model, ciph):
+    '''
+    Scores the decryption of ciph under all 256 single byte XOR keys, from one byte histogram
+    and one pair histogram of the ciphertext, without decrypting it. Sums are taken over the
+    histogram instead of the message, so floats may differ from score_buffer in the last bits.
+
+    Inputs
+
+        model - dict - Compiled model from compile_model
+        ciph - bytes-like - Ciphertext
+
+    Outputs
+
+        scores - list(float) - scores[k] is the score of ciph XOR-ed with k
+    '''
+
+    counts = Counter(ciph).items()
+    pair_counts = Counter(pair_values(ciph)).items() if model['bigram_weight'] else ()
+    uni, bi = model['unigram'], model['bigram']
+    scores = []
+
+    for k in range(256):
+        pair_k = k | k << 8 # the same key on both bytes of a pair, in either byte order
+        if model['kind'] == 'chi_squared':
+            score = -chi_squared([(byte ^ k, n) for byte, n in counts], model['unigram_categories'],
+                                 model['unigram_expected'], len(ciph)) if counts else 0.0
+            if pair_counts:
+                score -= model['bigram_weight'] * chi_squared([(pair ^ pair_k, n) for pair, n in pair_counts],
+                                                              model['bigram_categories'],
+                                                              model['bigram_expected'], len(ciph) - 1)
+        else:
+            score = sum([uni[byte ^ k] * n for byte, n in counts])
+            if pair_counts:
+                score += model['bigram_weight'] * sum([bi[pair ^ pair_k] * n for pair, n in pair_counts])
+        scores.append(score)
+
+    return scores
+
+def main():
+    cipher = bytes.fromhex("1b37373331363f78151b7f2b783431333d78397828372d363c78373e783a393b3736")
+
+    for kind in ('frequency', 'log_likelihood', 'chi_squared'):
+        for bigrams in (False, True):
+            scores = score_all_keys(compile_model(kind, bigrams), cipher)
+            key = max(range(256), key=scores.__getitem__)
+            print("{:<15} bigrams={:<6} key={:>3} {}".format(kind, str(bigrams), key,
+                                                             bytes([c ^ key for c in cipher])))
+
+if __name__ == "__main__":
+    main()